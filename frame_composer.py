@@ -0,0 +1,255 @@
+#########################################################################
+#     PatternPDFProjector - PDF Viewer for sewing pattern projection
+#     Copyright (C) 2024 Pere Rafols Soler
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# Frame composition without Qt: from a rendered page buffer and a view state to the projected frame.
+# Everything here works on numpy arrays so it can run in worker threads, other processes or benchmarks.
+
+import math
+import threading
+from dataclasses import dataclass, replace
+
+import numpy as np
+import cv2 as cv
+
+ERODE_SIZE = 3 #Must be odd to have a center in order to grow from the line center
+ERODE_KERNEL = cv.getStructuringElement(cv.MORPH_ELLIPSE, (ERODE_SIZE, ERODE_SIZE)) #Works smoother using a circle
+
+INTERPOLATION_MODES = {'nearest': cv.INTER_NEAREST,
+                       'linear': cv.INTER_LINEAR,
+                       'cubic': cv.INTER_CUBIC,
+                       'area': cv.INTER_AREA, # warpAffine falls back to linear, the refined frame is area downsampled anyway
+                       'lanczos': cv.INTER_LANCZOS4}
+
+SNAP_ANGLE = 45.0 # Fast rotation steps
+
+@dataclass(frozen=True)
+class ViewState:
+    xoffset: float # Page pixel (after mirroring) at the center of the frame
+    yoffset: float
+    rotation: float # Degrees
+    mirror: bool
+    hue_offset: int # Hue rotation from 0 to 179
+    sat_multiplier: float
+    val_multiplier: float
+    thickness: int # Line grow iterations
+    invert: bool
+    frame_width: int # Projector geometry in rendered page pixels
+    frame_height: int
+    interactive: bool = False # Use the cheap quality tier
+
+@dataclass(frozen=True)
+class QualitySettings:
+    interactive_interpolation: int = cv.INTER_NEAREST
+    interactive_downsample: int = 1
+    interactive_thickness: bool = False
+    refined_interpolation: int = cv.INTER_LINEAR
+
+@dataclass(frozen=True)
+class FrameSource:
+    # HSV image mapped to the full rendered page as page = image / factor + origin
+    hsv: np.ndarray
+    xorigin: float = 0.0
+    yorigin: float = 0.0
+    factor: float = 1.0
+
+def bgr2hsv(bgr):
+    return cv.cvtColor(bgr, cv.COLOR_BGR2HSV)
+
+def rotationMatrix(view):
+    # Offset and rotation of the page pixels into the frame
+    rotMat = cv.getRotationMatrix2D((view.xoffset, view.yoffset), -view.rotation, 1.0)
+    rotMat[0][2] += (view.frame_width / 2) - view.xoffset
+    rotMat[1][2] += (view.frame_height / 2) - view.yoffset
+    return rotMat
+
+def warpMatrix(view, source, pageWidth):
+    # Matrix from the (already mirrored) source pixels to the frame scaled by source.factor
+    factor = source.factor
+    pixelShift = 0.5 / factor - 0.5 # Pixel centers do not line up when the resolution changes
+    xorigin = source.xorigin + pixelShift
+    yorigin = source.yorigin + pixelShift
+    if view.mirror:
+        xorigin = pageWidth - 1 - xorigin - (source.hsv.shape[1] - 1) / factor
+    rotMat = rotationMatrix(view)
+    rotMat[:, 2] = factor * (rotMat[:, 0] * xorigin + rotMat[:, 1] * yorigin + rotMat[:, 2] - pixelShift)
+    return rotMat
+
+def frameMatrix(view, pageWidth):
+    # 3x3 matrix from continuous page coordinates to continuous frame coordinates, used to draw vectors
+    toIndex = np.array([[1.0, 0.0, -0.5], [0.0, 1.0, -0.5], [0.0, 0.0, 1.0]])
+    fromIndex = np.array([[1.0, 0.0, 0.5], [0.0, 1.0, 0.5], [0.0, 0.0, 1.0]])
+    mirror = np.eye(3)
+    if view.mirror:
+        mirror = np.array([[-1.0, 0.0, pageWidth - 1.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+    rotation = np.vstack((rotationMatrix(view), [0.0, 0.0, 1.0]))
+    return fromIndex @ rotation @ mirror @ toIndex
+
+def snapRotation(rotation, direction):
+    # Next snap angle from rotation, direction is 1 or -1
+    return math.floor(rotation / SNAP_ANGLE) * SNAP_ANGLE + SNAP_ANGLE * direction
+
+def snapNeighbourViews(view):
+    # Full quality views the next fast rotation step can show
+    view = replace(view, interactive=False)
+    return [replace(view, rotation=snapRotation(view.rotation, direction)) for direction in (1, -1)]
+
+def visiblePageRegion(view, pageShape, margin=2):
+    # Bounding box (x, y, w, h) of the projected area in rendered page pixels before mirroring, None if outside
+    imgHeight, imgWidth = pageShape[0:2]
+    cosr = math.fabs(math.cos(view.rotation * math.pi / 180))
+    sinr = math.fabs(math.sin(view.rotation * math.pi / 180))
+    xhalf = (cosr * view.frame_width + sinr * view.frame_height) / 2 + margin
+    yhalf = (sinr * view.frame_width + cosr * view.frame_height) / 2 + margin
+    xcenter = imgWidth - 1 - view.xoffset if view.mirror else view.xoffset
+    x0 = max(0, int(math.floor(xcenter - xhalf)))
+    x1 = min(imgWidth, int(math.ceil(xcenter + xhalf)))
+    y0 = max(0, int(math.floor(view.yoffset - yhalf)))
+    y1 = min(imgHeight, int(math.ceil(view.yoffset + yhalf)))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+def previewImage(hsv, sat_multiplier=0.2):
+    # Desaturated BGRA copy of the page shown behind the overlay in the viewer
+    arr = hsv.copy()
+    arr[:, :, 1] = cv.multiply(arr[:, :, 1], sat_multiplier)
+    return cv.cvtColor(cv.cvtColor(arr, cv.COLOR_HSV2BGR), cv.COLOR_BGR2BGRA)
+
+def applyColorEffects(hsv, hue_offset, sat_multiplier, val_multiplier):
+    # In place on an HSV image
+    hsv[:, :, 0] = hsv[:, :, 0] + hue_offset #Using this method instead of cv.add to get built-in overflow for color rotation
+    hsv[:, :, 1] = cv.multiply(hsv[:, :, 1], sat_multiplier)
+    hsv[:, :, 2] = cv.multiply(hsv[:, :, 2], val_multiplier)
+    return hsv
+
+def composeOverlay(source, view, pageWidth, interpolation=cv.INTER_LINEAR):
+    # Warps and colors the source into a BGRA frame of view.frame_width x view.frame_height
+    arr = source.hsv
+    if view.mirror:
+        arr = cv.flip(arr, 1)
+    factor = source.factor
+    frameSize = (max(1, round(view.frame_width * factor)), max(1, round(view.frame_height * factor)))
+    arr = cv.warpAffine(arr, warpMatrix(view, source, pageWidth), frameSize, flags=interpolation,
+                        borderMode=cv.BORDER_CONSTANT, borderValue=(0, 0, 255)) #Caution! the Border color is in HSV!
+    arr = applyColorEffects(arr, view.hue_offset, view.sat_multiplier, view.val_multiplier)
+    arr = cv.cvtColor(arr, cv.COLOR_HSV2BGR)
+    if factor < 1.0:
+        arr = cv.resize(arr, (view.frame_width, view.frame_height), interpolation=cv.INTER_NEAREST)
+    elif factor > 1.0:
+        arr = cv.resize(arr, (view.frame_width, view.frame_height), interpolation=cv.INTER_AREA)
+    return cv.cvtColor(arr, cv.COLOR_BGR2BGRA)
+
+def composeProjectorFrame(overlay, view, quality=QualitySettings()):
+    # Line thickening and color inversion of the overlay, the frame is drawn as is on the projector
+    thickness = view.thickness
+    if view.interactive and not quality.interactive_thickness:
+        thickness = 0
+    frame = overlay
+    if thickness > 0:
+        frame = cv.erode(src=frame, kernel=ERODE_KERNEL, iterations=thickness, anchor=(-1, -1),
+                         borderType=cv.BORDER_CONSTANT, borderValue=1)
+    if view.invert:
+        frame = frame.copy() if frame is overlay else frame
+        frame[:, :, 0:3] = 255 - frame[:, :, 0:3]
+    return frame
+
+class FrameComposer:
+    # Keeps the page buffers of the current page and composes frames from them
+    def __init__(self, quality=QualitySettings()):
+        self.quality = quality
+        self.page = None # (HSV page, downsampled HSV page), replaced as a whole so readers never mix pages
+        self.refined = None # FrameSource of the visible region rendered at a higher DPI
+        self.frameCache = {} # (overlay, frame) by full quality view, the current one and its snap neighbours
+        self.lockCache = threading.Lock()
+
+    def setPage(self, bgr):
+        hsv = bgr2hsv(bgr)
+        small = None
+        if self.quality.interactive_downsample > 1:
+            small = cv.resize(hsv, None, fx=1.0 / self.quality.interactive_downsample,
+                              fy=1.0 / self.quality.interactive_downsample, interpolation=cv.INTER_AREA)
+        self.refined = None
+        self.page = (hsv, small)
+        self.clearCachedFrames()
+
+    def getPageHSV(self):
+        return None if self.page is None else self.page[0]
+
+    def setRefinedRegion(self, bgr, xorigin, yorigin, factor):
+        self.refined = FrameSource(bgr2hsv(bgr), xorigin, yorigin, factor)
+
+    def clearRefinedRegion(self):
+        self.refined = None
+
+    def hasRefinedRegion(self):
+        return self.refined is not None
+
+    def selectSource(self, view, page):
+        # Downsampled page while interacting, the high DPI region when idle if available
+        hsv, small = page
+        if view.interactive:
+            if small is not None:
+                return FrameSource(small, factor=1.0 / self.quality.interactive_downsample), self.quality.interactive_interpolation
+            return FrameSource(hsv), self.quality.interactive_interpolation
+        refined = self.refined
+        if refined is not None:
+            return refined, self.quality.refined_interpolation
+        return FrameSource(hsv), self.quality.refined_interpolation
+
+    def compose(self, view):
+        # Returns the (overlay, projector frame) BGRA arrays, or None if there is no page yet
+        page = self.page
+        if page is None:
+            return None
+        source, interpolation = self.selectSource(view, page)
+        overlay = composeOverlay(source, view, page[0].shape[1], interpolation)
+        composed = overlay, composeProjectorFrame(overlay, view, self.quality)
+        if not view.interactive:
+            self.cacheFrame(view, composed, page)
+        return composed
+
+    def speculate(self, view):
+        # Composes the full page at full quality for a view that may be shown soon, like a snap rotation
+        page = self.page
+        if page is None:
+            return
+        overlay = composeOverlay(FrameSource(page[0]), view, page[0].shape[1], self.quality.refined_interpolation)
+        self.cacheFrame(view, (overlay, composeProjectorFrame(overlay, view, self.quality)), page)
+
+    def cacheFrame(self, view, composed, page):
+        with self.lockCache:
+            if self.page is page: # Otherwise the page changed while composing
+                self.frameCache[view] = composed
+
+    def cachedFrame(self, view):
+        # The (overlay, frame) already composed for this view at full quality, or None
+        with self.lockCache:
+            return self.frameCache.get(replace(view, interactive=False))
+
+    def hasCachedFrame(self, view):
+        return self.cachedFrame(view) is not None
+
+    def retainCachedFrames(self, view):
+        # Keeps the frames of view and its snap neighbours, the rest are not reachable by a single snap
+        keep = [replace(view, interactive=False)] + snapNeighbourViews(view)
+        with self.lockCache:
+            self.frameCache = {v: self.frameCache[v] for v in keep if v in self.frameCache}
+
+    def clearCachedFrames(self):
+        with self.lockCache:
+            self.frameCache = {}
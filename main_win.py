@@ -21,22 +21,30 @@ import sys
 
 from PyQt5.QtWidgets import (QWidget, QLabel,
                              QVBoxLayout, QHBoxLayout, QPushButton,
-                             QSplitter, QFileDialog, QGroupBox,
-                             QListWidgetItem, QListWidget, QFrame, QListView, QSlider, QCheckBox, QMessageBox)
-from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap, QRegion, QImage
-from PyQt5.QtCore import (Qt, QRect, QPoint, QModelIndex, QTimer)
+                             QSplitter, QFileDialog, QGroupBox, QStyle, QStyledItemDelegate,
+                             QAbstractItemView, QFrame, QListView, QSlider, QCheckBox, QMessageBox)
+from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap, QRegion, QImage, QTransform
+from PyQt5.QtCore import (Qt, QRect, QPoint, QSize, QModelIndex, QTimer, pyqtSignal, QAbstractListModel)
 import math
+from collections import OrderedDict
+from dataclasses import replace
 import popplerqt5
 import xml.etree.ElementTree as ET
 import numpy as np
 import cv2 as cv
 import threading
+import time
 import pikepdf
 
 import projector_win as prjWin
+import session_snapshot as snapshot
+import vector_paths as vecPaths
+import frame_composer as frameComposer
+import render_farm as renderFarm
+import session_replay as replay
 
 class AppPDFProjector(QWidget):
-    def __init__(self, viewer_screen, projector_screen, argsv):
+    def __init__(self, viewer_screen, projector_screen, argsv, recordFile=None):
         super().__init__()
 
         #A timer to auto clear layer selection
@@ -50,6 +58,17 @@ class AppPDFProjector(QWidget):
         self.timerDelayRender.timeout.connect(self.timer_delay_render)
         self.bResetOffsetRotation = False
 
+        # A timer to collect the pages rendered by the worker processes
+        self.timerRenderFarm = QTimer()
+        self.timerRenderFarm.timeout.connect(self.timer_render_farm)
+        self.renderFarm = None
+        self.refineJob = None # (job id, page, visible region, dpi factor) of the pending refined render
+
+        # A timer to write the session snapshot once the state settles
+        self.timerSessionSnapshot = QTimer()
+        self.timerSessionSnapshot.setSingleShot(True)
+        self.timerSessionSnapshot.timeout.connect(self.timer_session_snapshot)
+
         # read xml config
         script_directory = os.path.dirname(os.path.abspath(sys.argv[0]))
         tree = ET.parse(os.path.join(script_directory, 'config.xml'))
@@ -61,6 +80,9 @@ class AppPDFProjector(QWidget):
         self.width = 1280
         self.height = 800
         self.pdfdoc = None
+        self.pdf_fingerprint = ''
+        self.vectorPages = {} # Extracted line art by page index
+        self.userUnits = {} # PDF user units by page index
         self.renderDPI = float(root.find('render_dpi').text)
         self.projectorXDPI = float(root.find('projector_Xdpi').text)
         self.projectorYDPI = float(root.find('projector_Ydpi').text)
@@ -82,12 +104,33 @@ class AppPDFProjector(QWidget):
             self.projectorWidth = int(root.find('projector_width').text)
             self.projectorHeigth = int(root.find('projector_height').text)
 
+        self.renderWorkers = int(root.find('render_workers').text)
+        self.renderWorkerMaxJobs = int(root.find('render_worker_max_jobs').text)
+        self.sessionSnapshotEnabled = root.find('session_snapshot').text.upper() == 'TRUE'
+        self.sessionSnapshotDelay = int(root.find('session_snapshot_delay_ms').text)
+        self.sessionSnapshot = snapshot.SessionSnapshot(root.find('session_snapshot_dir').text,
+                                                        int(root.find('session_snapshot_max_files').text))
+
+        refinement = root.find('progressive_refinement')
+        self.refinedDPIFactor = float(refinement.find('refined_dpi_factor').text)
+        refineIdleDelay = int(refinement.find('idle_delay_ms').text)
+        qualitySettings = frameComposer.QualitySettings(
+            interactive_interpolation=frameComposer.INTERPOLATION_MODES[refinement.find('interactive_interpolation').text.lower()],
+            interactive_downsample=max(1, int(refinement.find('interactive_downsample').text)),
+            interactive_thickness=refinement.find('interactive_thickness').text.upper() == 'TRUE',
+            refined_interpolation=frameComposer.INTERPOLATION_MODES[refinement.find('refined_interpolation').text.lower()])
+
         self.projectorScreen = projector_screen
         self.argsv = argsv
+        self.recordFile = recordFile # Input recording for session_replay.py
+        self.inputRecorder = None
         self.pdf_page_idex = 0
         self.projectorWidget = ProjectorPaintWidget(self.projectorWidth, self.projectorHeigth,
                                                     self.projectorScreen, self.fullscreenmode,
-                                                    self.renderDPI, self.projectorXDPI, self.projectorYDPI)
+                                                    self.renderDPI, self.projectorXDPI, self.projectorYDPI,
+                                                    qualitySettings, refineIdleDelay)
+        self.projectorWidget.frame_composed.connect(self.scheduleSessionSnapshot)
+        self.projectorWidget.refine_requested.connect(self.refine_render)
 
         self.initUI()
         qr = viewer_screen.geometry()
@@ -113,6 +156,12 @@ class AppPDFProjector(QWidget):
         self.hboxtopbuttons.addWidget(self.BtnMirror)
         self.BtnMirror.clicked.connect(self.mirror_btn_clicked)
 
+        #Vector mode btn
+        self.BtnVectorMode = QPushButton('Vector')
+        self.BtnVectorMode.setCheckable(True)
+        self.hboxtopbuttons.addWidget(self.BtnVectorMode)
+        self.BtnVectorMode.clicked.connect(self.vector_btn_clicked)
+
         #Color effects
         self.frmColorEffects = QGroupBox()
         self.frmColorEffects.setTitle('Color Effects')
@@ -190,10 +239,20 @@ class AppPDFProjector(QWidget):
         self.VBoxPageSplitter.setCollapsible(0, False)
 
         #List view for pages
-        self.listview_pdfpages = QListWidget()
+        self.listview_pdfpages = QListView()
         self.listview_pdfpages.setLineWidth(0)
         self.listview_pdfpages.setFixedWidth(int(0.15*self.width))
-        self.listview_pdfpages.itemClicked.connect(self.list_pages_clicked)
+        self.listview_pdfpages.setUniformItemSizes(True) # Avoids querying every row to lay out the list
+        self.listview_pdfpages.setSpacing(2)
+        self.listview_pdfpages.setSelectionMode(QAbstractItemView.SingleSelection)
+        cellWidth = (self.listview_pdfpages.width() -
+                     self.listview_pdfpages.style().pixelMetric(QStyle.PM_ScrollBarExtent) - 8)
+        thumbnailSize = QSize(int(0.6 * self.listview_pdfpages.width()), int(0.6 * self.listview_pdfpages.width() * 1.3))
+        self.pagesModel = PdfPagesModel(thumbnailSize, self.getPdfUserUnits, self.getLayerVisibility)
+        self.listview_pdfpages.setModel(self.pagesModel)
+        self.listview_pdfpages.setItemDelegate(PdfPageDelegate(QSize(cellWidth, thumbnailSize.height() + 30)))
+        self.listview_pdfpages.selectionModel().currentRowChanged.connect(self.list_pages_changed)
+        self.listview_pdfpages.verticalScrollBar().valueChanged.connect(self.list_pages_scrolled)
         self.pagesLayout.addWidget(self.listview_pdfpages)
 
         # List view for layers
@@ -204,9 +263,7 @@ class AppPDFProjector(QWidget):
 
         # Load PDF file
         if len(self.pdf_filename) > 0:
-            self.openPDF()
-            self.pdfLoadPage2Qimage(True)
-            self.listview_pdfpages.itemWidget(self.listview_pdfpages.item(0)).setSelected(True)
+            self.loadPDF()
 
         self.VBoxPageSplitter.addWidget(self.projectorWidget)
         self.VBoxPageSplitter.setCollapsible(1, False)
@@ -214,6 +271,8 @@ class AppPDFProjector(QWidget):
 
         self.show()
     def layer_data_changed(self):
+        self.recordInput({'type': 'layers', 'states': self.getLayerVisibility()})
+        self.projectorWidget.setHiddenLayers(self.getHiddenLayerNames())
         self.pdfLoadPage2Qimage(False)
     def layer_selection_changed(self):
         self.timerLayerSelClear.start(1)  # Exec a timer to clear selection asap
@@ -233,6 +292,24 @@ class AppPDFProjector(QWidget):
 
     def slider_thickness_changed(self):
         self.projectorWidget.setThickness(self.sliderThickness.value())
+        self.scheduleSessionSnapshot()
+
+    def loadPDF(self):
+        self.pdf_fingerprint = snapshot.documentFingerprint(self.pdf_filename)
+        self.vectorPages = {}
+        self.userUnits = {}
+        restoredState = self.restoreSessionSnapshot() # Done before any poppler work
+        self.startRenderFarm()
+        self.openPDF()
+        self.projectorWidget.setHiddenLayers(self.getHiddenLayerNames())
+        if restoredState is None:
+            self.pdf_page_idex = 0
+            self.pdfLoadPage2Qimage(True)
+        else:
+            self.setLayerVisibility(restoredState['layers'])
+        self.listview_pdfpages.setCurrentIndex(self.pagesModel.index(self.pdf_page_idex))
+        self.listview_pdfpages.scrollTo(self.pagesModel.index(self.pdf_page_idex))
+        self.startInputRecording()
 
     def openPDF(self):
         #Load thumnails
@@ -246,33 +323,62 @@ class AppPDFProjector(QWidget):
             self.listview_pdflayers.model().dataChanged.connect(self.layer_data_changed)
             self.listview_pdflayers.clicked.connect(self.layer_selection_changed) #using this trick to not allow selecting any item
 
-        numpages = self.pdfdoc.numPages()
-        self.listview_pdfpages.clear()
-        for i in range(0, numpages):
-            unitPDF = self.getPdfUserUnits(i)
-            pageImg = self.pdfdoc.page(i)
-            pageWidthInch = pageImg.pageSizeF().width() * unitPDF/72.0
-            thumnailDPI = 0.6*self.listview_pdfpages.width() / pageWidthInch
-            pImg = pageImg.renderToImage(thumnailDPI * unitPDF, thumnailDPI * unitPDF)
-            myPageThumb = pdfPagePreviewWidget()
-            myPageThumb.setPageNumberText(i+1)
-            myPageThumb.setPDFImage(pImg)
-            myQListWidgetItem = QListWidgetItem(self.listview_pdfpages)
-            # Set size hint
-            myQListWidgetItem.setSizeHint(myPageThumb.sizeHint())
-            # Add QListWidgetItem into QListWidget
-            self.listview_pdfpages.addItem(myQListWidgetItem)
-            self.listview_pdfpages.setItemWidget(myQListWidgetItem, myPageThumb)
+        # Thumbnails are rendered by the model only when their row gets painted
+        self.pagesModel.setDocument(self.pdfdoc)
 
     # method to get userunit for PDF files not using the standard dot size of 1/72 inch
     def getPdfUserUnits(self, page):
         # Get User units using pikepdf
-        pdf = pikepdf.Pdf.open(self.pdf_filename)
-        page = pdf.pages[page]
-        userunit = 1.0
-        if '/UserUnit' in page:
-            userunit = float(page.UserUnit)
-        return userunit
+        if page not in self.userUnits:
+            pdf = pikepdf.Pdf.open(self.pdf_filename)
+            pdfPage = pdf.pages[page]
+            userunit = 1.0
+            if '/UserUnit' in pdfPage:
+                userunit = float(pdfPage.UserUnit)
+            self.userUnits[page] = userunit
+        return self.userUnits[page]
+
+    def startRenderFarm(self):
+        # Worker processes for the renders that can be done in background: thumbnails and refined regions
+        self.stopRenderFarm()
+        if self.renderWorkers > 0:
+            self.renderFarm = renderFarm.RenderFarm(self.pdf_filename, self.renderWorkers, self.renderWorkerMaxJobs)
+            self.timerRenderFarm.start(10)
+        self.pagesModel.setRenderFarm(self.renderFarm)
+
+    def stopRenderFarm(self):
+        self.timerRenderFarm.stop()
+        self.refineJob = None
+        if self.renderFarm is not None:
+            self.renderFarm.shutdown()
+            self.renderFarm = None
+
+    def timer_render_farm(self):
+        for job, arr in self.renderFarm.poll():
+            img = QImage(arr.tobytes(), arr.shape[1], arr.shape[0], QImage.Format_ARGB32)
+            if job.tag == 'thumbnail':
+                self.pagesModel.setThumbnail(job.page, img)
+            elif job.tag == 'refine' and self.refineJob is not None and self.refineJob[0] == job.job_id:
+                _, page, region, factor = self.refineJob
+                self.refineJob = None
+                # Only useful if the view did not change while rendering
+                if (page == self.pdf_page_idex and not self.projectorWidget.bInteractive and
+                        region == self.projectorWidget.getVisiblePageRegion()):
+                    self.projectorWidget.setRefinedImage(img, job.region[0] / factor, job.region[1] / factor, factor)
+        for job in self.renderFarm.takeFailedJobs():
+            if job.tag == 'thumbnail':
+                self.pagesModel.setThumbnailFailed(job.page)
+            elif self.refineJob is not None and self.refineJob[0] == job.job_id:
+                self.refineJob = None
+        if not self.renderFarm.isAvailable():
+            # The workers keep dying, render in this process as when render_workers is 0
+            self.stopRenderFarm()
+            self.pagesModel.setRenderFarm(None)
+
+    def cancelRefineJob(self):
+        if self.refineJob is not None and self.renderFarm is not None:
+            self.renderFarm.cancel(self.refineJob[0])
+        self.refineJob = None
 
     def invertcolors_btn_clicked(self):
         self.projectorWidget.setInvertColors(self.BtnInvertColors.isChecked(), self.BtnInvertColors.isChecked() and self.checkBoxInvertBoth.isChecked())
@@ -280,11 +386,158 @@ class AppPDFProjector(QWidget):
     def mirror_btn_clicked(self):
         self.projectorWidget.setMirror(self.BtnMirror.isChecked())
 
+    def vector_btn_clicked(self):
+        if self.BtnVectorMode.isChecked() and len(self.pdf_filename) > 0:
+            vectorPage = self.getVectorPage(self.pdf_page_idex)
+            if vectorPage is None:
+                self.BtnVectorMode.setChecked(False) # Back to the raster frame
+            else:
+                self.projectorWidget.setVectorPage(vectorPage)
+        self.projectorWidget.setVectorMode(self.BtnVectorMode.isChecked())
+        self.scheduleSessionSnapshot() # No frame is composed when only the projection mode changes
+
+    def getVectorPage(self, page):
+        # The line art is extracted once per page, returns None if the content streams cannot be parsed
+        if page not in self.vectorPages:
+            self.setCursor(Qt.WaitCursor)
+            try:
+                self.vectorPages[page] = vecPaths.extractPagePaths(self.pdf_filename, page, self.renderDPI)
+            except (pikepdf.PdfError, ValueError, TypeError, KeyError, IndexError):
+                self.vectorPages[page] = None # Encrypted or malformed, not retried
+            self.setCursor(Qt.ArrowCursor)
+        return self.vectorPages[page]
+
     def closeEvent(self, event):
-        self.projectorWidget.close()
+        try:
+            self.stopInputRecording()
+            self.saveSessionSnapshotNow()
+        finally:
+            self.stopRenderFarm() # Never leave the worker processes running
+            self.projectorWidget.close()
         event.accept()
 
+    def layerModelIndexes(self):
+        # All the optional content items in depth-first order
+        if self.pdfdoc is None or not self.pdfdoc.hasOptionalContent():
+            return []
+        return renderFarm.optionalContentIndexes(self.pdfdoc.optionalContentModel())
+
+    def getLayerVisibility(self):
+        states = []
+        for idx in self.layerModelIndexes():
+            state = idx.data(Qt.CheckStateRole)
+            states.append(None if state is None else int(state))
+        return states
+
+    def setLayerVisibility(self, states):
+        indexes = self.layerModelIndexes()
+        if len(indexes) != len(states):
+            return
+        for idx, state in zip(indexes, states):
+            if state is not None and int(idx.data(Qt.CheckStateRole)) != state:
+                idx.model().setData(idx, state, Qt.CheckStateRole)
+
+    def getHiddenLayerNames(self):
+        return frozenset(str(idx.data(Qt.DisplayRole)) for idx in self.layerModelIndexes()
+                         if idx.data(Qt.CheckStateRole) == Qt.Unchecked)
+
+    def getSessionState(self):
+        return {'fingerprint': self.pdf_fingerprint,
+                'pdf_filename': self.pdf_filename,
+                'render_dpi': self.renderDPI,
+                'projector_width': self.projectorWidth,
+                'projector_height': self.projectorHeigth,
+                'page': self.pdf_page_idex,
+                'xoffset': float(self.projectorWidget.xoffset),
+                'yoffset': float(self.projectorWidget.yoffset),
+                'rotation': float(self.projectorWidget.rotation),
+                'scale': float(self.projectorWidget.scale),
+                'mirror': self.BtnMirror.isChecked(),
+                'invert_colors': self.BtnInvertColors.isChecked(),
+                'invert_both': self.checkBoxInvertBoth.isChecked(),
+                'hue': self.sliderHue.value(),
+                'saturation': self.sliderSaturation.value(),
+                'value': self.sliderValue.value(),
+                'thickness': self.sliderThickness.value(),
+                'vector_mode': self.BtnVectorMode.isChecked(),
+                'layers': self.getLayerVisibility()}
+
+    def scheduleSessionSnapshot(self):
+        if self.sessionSnapshotEnabled and self.pdfdoc is not None:
+            self.timerSessionSnapshot.start(self.sessionSnapshotDelay)
+
+    def timer_session_snapshot(self):
+        if self.sessionSnapshot.isSaving():
+            self.timerSessionSnapshot.start(self.sessionSnapshotDelay) # Try again when the previous write is done
+            return
+        buffers = self.projectorWidget.getSessionBuffers()
+        if buffers is not None:
+            self.sessionSnapshot.save(self.getSessionState(), *buffers)
+
+    def saveSessionSnapshotNow(self):
+        self.timerSessionSnapshot.stop()
+        if not self.sessionSnapshotEnabled or self.pdfdoc is None:
+            return
+        buffers = self.projectorWidget.getSessionBuffers()
+        if buffers is not None:
+            self.sessionSnapshot.saveNow(self.getSessionState(), *buffers)
+
+    def restoreSessionSnapshot(self):
+        # Restores the last frame and the interactive state of this document, returns None if there is no snapshot
+        if not self.sessionSnapshotEnabled:
+            return None
+        restored = self.sessionSnapshot.load(self.pdf_fingerprint)
+        if restored is None:
+            return None
+        state, page_buffer, frame = restored
+        if (state['render_dpi'] != self.renderDPI or
+                state['projector_width'] != self.projectorWidth or
+                state['projector_height'] != self.projectorHeigth):
+            return None # Snapshot taken with a different projector calibration
+
+        self.pdf_page_idex = state['page']
+        self.projectorWidget.setPdfImage(snapshot.array2qimage(page_buffer))
+        self.applySessionState(state)
+        self.projectorWidget.projectorWindow.showFrame(snapshot.array2qimage(frame))
+        return state
+
+    def applySessionState(self, state):
+        # Interactive state of a snapshot or a recording, the page and layers are set by the caller
+        self.BtnMirror.setChecked(state['mirror'])
+        self.BtnInvertColors.setChecked(state['invert_colors'])
+        self.checkBoxInvertBoth.setChecked(state['invert_both'])
+        self.sliderHue.setValue(state['hue'])
+        self.sliderSaturation.setValue(state['saturation'])
+        self.sliderValue.setValue(state['value'])
+        self.sliderThickness.setValue(state['thickness'])
+        self.mirror_btn_clicked()
+        self.invertcolors_btn_clicked()
+        self.projectorWidget.setViewState(state['xoffset'], state['yoffset'], state['rotation'], state['scale'])
+        if state.get('vector_mode', False) != self.BtnVectorMode.isChecked():
+            self.BtnVectorMode.setChecked(state.get('vector_mode', False))
+            self.vector_btn_clicked()
+
+    def startInputRecording(self):
+        # Only the first loaded document is recorded, a replay runs against a single pdf
+        if self.recordFile is None or self.timerDelayRender.isActive():
+            return # Started again once the page is rendered, the header needs the final offset and scale
+        if self.inputRecorder is None:
+            self.inputRecorder = replay.InputRecorder(self.recordFile, self)
+        elif self.inputRecorder.fingerprint != self.pdf_fingerprint:
+            self.stopInputRecording()
+            self.recordFile = None
+
+    def stopInputRecording(self):
+        if self.inputRecorder is not None:
+            self.inputRecorder.close()
+            self.inputRecorder = None
+
+    def recordInput(self, entry):
+        if self.inputRecorder is not None:
+            self.inputRecorder.record(entry)
+
     def pdfLoadPage2Qimage(self, ResetOffsetRotation):
+        self.cancelRefineJob() # Rendered with the previous page or layers
         self.setCursor(Qt.WaitCursor)
         self.projectorWidget.setCursor(Qt.WaitCursor)
         self.bResetOffsetRotation = ResetOffsetRotation
@@ -295,65 +548,196 @@ class AppPDFProjector(QWidget):
         pageImg = self.pdfdoc.page(self.pdf_page_idex)
         unitPDF = self.getPdfUserUnits(self.pdf_page_idex)
         self.projectorWidget.setPdfImage(pageImg.renderToImage(self.renderDPI * unitPDF, self.renderDPI * unitPDF))
+        if self.BtnVectorMode.isChecked():
+            self.vector_btn_clicked() # Falls back to raster if this page cannot be extracted
         if self.bResetOffsetRotation:
             self.projectorWidget.resetOffsetRotation()
+        self.startInputRecording()
 
         self.setCursor(Qt.ArrowCursor)
         self.projectorWidget.setCursor(Qt.OpenHandCursor)
 
+    def refine_render(self):
+        # Re-renders the projected part of the page at a higher DPI for the idle frame
+        if self.pdfdoc is None or self.refinedDPIFactor <= 1.0:
+            return
+        region = self.projectorWidget.getVisiblePageRegion()
+        if region is None:
+            return
+        factor = self.refinedDPIFactor
+        unitPDF = self.getPdfUserUnits(self.pdf_page_idex)
+        x = int(region[0] * factor)
+        y = int(region[1] * factor)
+        w = int(math.ceil(region[2] * factor))
+        h = int(math.ceil(region[3] * factor))
+        dpi = self.renderDPI * factor * unitPDF
+        if self.renderFarm is not None:
+            self.cancelRefineJob()
+            jobId = self.renderFarm.submit(renderFarm.RenderJob(self.pdf_page_idex, dpi, dpi, (x, y, w, h),
+                                                                tuple(self.getLayerVisibility()),
+                                                                renderFarm.PRIORITY_PROJECTED, 'refine'))
+            self.refineJob = (jobId, self.pdf_page_idex, region, factor)
+            return
+        refinedImg = self.pdfdoc.page(self.pdf_page_idex).renderToImage(dpi, dpi, x, y, w, h)
+        self.projectorWidget.setRefinedImage(refinedImg, x / factor, y / factor, factor)
+
     def open_btn_clicked(self):
         pdffileName, _ = QFileDialog.getOpenFileName(self, "QFileDialog.getOpenFileName()", "",
                                                   "PDF Files (*.pdf)")
         if pdffileName:
+            self.saveSessionSnapshotNow() # Keep the session of the previous document
             self.pdf_filename = pdffileName
-            self.pdf_page_idex = 0
-            self.openPDF()
+            self.loadPDF()
+    def list_pages_scrolled(self):
+        viewport = self.listview_pdfpages.viewport().rect()
+        self.pagesModel.demoteThumbnailJobs(
+            lambda page: self.listview_pdfpages.visualRect(self.pagesModel.index(page)).intersects(viewport))
+
+    def list_pages_changed(self, current, previous):
+        idx = current.row()
+        if idx >= 0 and idx != self.pdf_page_idex:
+            self.recordInput({'type': 'page', 'page': idx})
+            self.pdf_page_idex = idx
             self.pdfLoadPage2Qimage(True)
-            self.listview_pdfpages.itemWidget(self.listview_pdfpages.item(0)).setSelected(True)
-    def list_pages_clicked(self, item):
-       idx = self.listview_pdfpages.indexFromItem(item).row()
 
-       for i in range(0, self.listview_pdfpages.count()):
-           self.listview_pdfpages.itemWidget(self.listview_pdfpages.item(i)).setSelected(False)
+class PdfPagesModel(QAbstractListModel):
+    def __init__(self, thumbnailSize, getUserUnits, getLayerStates, parent=None):
+        super().__init__(parent)
+        self.pdfdoc = None
+        self.numpages = 0
+        self.thumbnailSize = thumbnailSize
+        self.getUserUnits = getUserUnits
+        self.getLayerStates = getLayerStates
+        self.renderFarm = None # Thumbnails are rendered in the worker processes when available
+        self.thumbnailJobs = {} # Render job id by page
+        self.failedPages = set() # Pages whose thumbnail job crashed the workers, never submitted again
+        self.backgroundPages = set() # Pages of the thumbnail jobs demoted after scrolling out of view
+        self.maxCachedThumbnails = 256
+        self.thumbnails = OrderedDict() # Rendered thumbnails by page, least recently used first
+
+    def setDocument(self, pdfdoc):
+        self.beginResetModel()
+        self.pdfdoc = pdfdoc
+        self.numpages = pdfdoc.numPages()
+        self.thumbnails.clear()
+        self.thumbnailJobs.clear()
+        self.backgroundPages.clear()
+        self.failedPages.clear()
+        self.endResetModel()
+
+    def setRenderFarm(self, renderFarm):
+        self.renderFarm = renderFarm
+        self.thumbnailJobs.clear()
+        self.backgroundPages.clear()
+        if self.numpages > 0: # Rows waiting for a job of the previous farm are requested again
+            self.dataChanged.emit(self.index(0), self.index(self.numpages - 1), [Qt.DecorationRole])
+
+    def setThumbnailFailed(self, page):
+        self.thumbnailJobs.pop(page, None)
+        self.backgroundPages.discard(page)
+        self.failedPages.add(page)
+
+    def demoteThumbnailJobs(self, isPageVisible):
+        # Pages scrolled out of view are rendered after the visible ones
+        if self.renderFarm is None:
+            return
+        for page, job_id in self.thumbnailJobs.items():
+            if page not in self.backgroundPages and not isPageVisible(page):
+                self.renderFarm.setPriority(job_id, renderFarm.PRIORITY_BACKGROUND)
+                self.backgroundPages.add(page)
+
+    def setThumbnail(self, page, img):
+        self.thumbnailJobs.pop(page, None)
+        self.backgroundPages.discard(page)
+        if page >= self.numpages:
+            return
+        self.thumbnails[page] = img
+        if len(self.thumbnails) > self.maxCachedThumbnails:
+            self.thumbnails.popitem(last=False)
+        self.dataChanged.emit(self.index(page), self.index(page), [Qt.DecorationRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.numpages
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.numpages:
+            return None
+        if role == Qt.DisplayRole:
+            return str(index.row() + 1)
+        if role == Qt.DecorationRole:
+            return self.getThumbnail(index.row())
+        return None
+
+    def getThumbnail(self, page):
+        if page in self.thumbnails:
+            self.thumbnails.move_to_end(page)
+            return self.thumbnails[page]
+        if page in self.failedPages:
+            return None
+
+        unitPDF = self.getUserUnits(page)
+        pageImg = self.pdfdoc.page(page)
+        pageWidthInch = pageImg.pageSizeF().width() * unitPDF / 72.0
+        pageHeightInch = pageImg.pageSizeF().height() * unitPDF / 72.0
+        thumnailDPI = min(self.thumbnailSize.width() / pageWidthInch, self.thumbnailSize.height() / pageHeightInch)
+
+        if self.renderFarm is not None:
+            # Requested while painting, so the page is visible: render it before the older requests
+            self.backgroundPages.discard(page)
+            if page in self.thumbnailJobs and self.renderFarm.isPending(self.thumbnailJobs[page]):
+                self.renderFarm.setPriority(self.thumbnailJobs[page], renderFarm.PRIORITY_VISIBLE)
+            else:
+                self.thumbnailJobs[page] = self.renderFarm.submit(
+                    renderFarm.RenderJob(page, thumnailDPI * unitPDF, thumnailDPI * unitPDF,
+                                         layer_states=tuple(self.getLayerStates()),
+                                         priority=renderFarm.PRIORITY_VISIBLE, tag='thumbnail'))
+            return None
 
-       self.listview_pdfpages.itemWidget(item).setSelected(True)
-       if idx != self.pdf_page_idex:
-            self.pdf_page_idex = idx
-            self.pdfLoadPage2Qimage(True)
+        pImg = pageImg.renderToImage(thumnailDPI * unitPDF, thumnailDPI * unitPDF)
+
+        self.thumbnails[page] = pImg
+        if len(self.thumbnails) > self.maxCachedThumbnails:
+            self.thumbnails.popitem(last=False)
+        return pImg
+
+class PdfPageDelegate(QStyledItemDelegate):
+    def __init__(self, cellSize, parent=None):
+        super().__init__(parent)
+        self.cellSize = cellSize
 
-class pdfPagePreviewWidget(QFrame):
-    def __init__(self, parent=None):
-        super(pdfPagePreviewWidget, self).__init__(parent)
-        self.VBox = QVBoxLayout()
-        self.setFrameStyle(QFrame.StyledPanel | QFrame.Plain)
-        self.setLineWidth(0)
-
-        self.setAttribute(Qt.WA_StyledBackground, True)
-        self.setStyleSheet('background-color: gray;')
-
-        self.lblpageimage = QLabel()
-        self.lblpagenumber = QLabel()
-        self.lblpagenumber.setAlignment(Qt.AlignCenter)
-        self.lblpageimage.setAlignment(Qt.AlignCenter)
-        self.VBox.addWidget(self.lblpageimage)
-        self.VBox.addWidget(self.lblpagenumber)
-        self.setLayout(self.VBox)
-
-    def setPageNumberText (self, pagenumber):
-        self.lblpagenumber.setText(str(pagenumber))
-
-    def setPDFImage (self, pdfimg):
-        self.lblpageimage.setPixmap(QPixmap.fromImage(pdfimg))
-
-    def setSelected (self, sel):
-        if sel:
-            self.setStyleSheet('background-color: rgba(0, 50, 50, 150);')
+    def sizeHint(self, option, index):
+        return self.cellSize # Fixed size, so the thumbnail is not rendered just to lay out the list
+
+    def paint(self, qp, option, index):
+        qp.save()
+        if option.state & QStyle.State_Selected:
+            qp.fillRect(option.rect, QColor(0, 50, 50, 150))
         else:
-            self.setStyleSheet('background-color: gray;')
+            qp.fillRect(option.rect, Qt.gray)
+
+        fm = option.fontMetrics
+        textHeight = fm.height() + 6
+        thumbArea = option.rect.adjusted(0, 4, 0, -textHeight)
+        thumb = index.data(Qt.DecorationRole)
+        if thumb is not None:
+            x = thumbArea.left() + (thumbArea.width() - thumb.width()) // 2
+            y = thumbArea.top() + (thumbArea.height() - thumb.height()) // 2
+            qp.drawImage(x, y, thumb)
+
+        textArea = QRect(option.rect.left(), option.rect.bottom() - textHeight, option.rect.width(), textHeight)
+        qp.drawText(textArea, Qt.AlignCenter, index.data(Qt.DisplayRole))
+        qp.restore()
 
 class ProjectorPaintWidget(QWidget):
-    def __init__(self, projectoWidth, projectorHeight, projectorScreen, fullscreenmode, renderDPI, projectorXDPI, projectorYDPI):
+    frame_composed = pyqtSignal()
+    vector_frame_drawn = pyqtSignal() # The projector shows these instead of the composed frames in vector mode
+    refine_requested = pyqtSignal()
+    def __init__(self, projectoWidth, projectorHeight, projectorScreen, fullscreenmode, renderDPI, projectorXDPI, projectorYDPI,
+                 qualitySettings, refineIdleDelay):
         self.dragModeIsRotation = False
+        self.bMousePressed = False
         self.prev_xevent = 0
         self.prev_yevent = 0
         self.rotation_delta_cumulative = 0
@@ -372,21 +756,36 @@ class ProjectorPaintWidget(QWidget):
         self.renderWidth = int(projectoWidth * self.render_dpi/self.projector_xdpi)
         self.renderHeight = int(projectorHeight * self.render_dpi/self.projector_ydpi)
         self.scale = 1.0
+        self.bInteractive = False # Cheap frames are computed while the user is moving the pattern or the sliders
+        self.bFrameInteractive = False # The current projector frame was computed in interactive mode
+        self.refineIdleDelay = refineIdleDelay
+        self.composer = frameComposer.FrameComposer(qualitySettings)
+        self.bVectorMode = False
+        self.vectorPage = None
+        self.vectorViewState = None # View state of the last vector projection
+        self.hiddenLayers = frozenset()
 
         super().__init__()
+        self.timerRefine = QTimer()
+        self.timerRefine.setSingleShot(True)
+        self.timerRefine.timeout.connect(self.timer_refine)
         self.timerDelayHSVRedraw = QTimer()
         self.timerDelayHSVRedraw.setSingleShot(False)
         self.timerDelayHSVRedraw.timeout.connect(self.timer_delay_hsvredraw)
         self.timerDelayHSVRedraw.start(1)
         self.bRedrawHSVImage = False
         self.threadHSVRecompute = threading.Thread(target=self.thread_hsvRecompute)
+        self.threadSpeculate = threading.Thread(target=self.composer.speculate) # Snap frames, never delays a recompute
         self.mutexHSV = threading.Lock()
         self.bForceRedrawByTimmer = False
+        self.frameStateTime = 0.0 # perf_counter when the view state of the frame in progress was taken
+        self.vectorFrameStateTime = 0.0 # Same for the last vector projection
         initImg = QPixmap(self.renderWidth, self.renderHeight)
         initImg.fill(Qt.gray)
         self.img = initImg.toImage()  # This is the displayed image
         self.imgHSVOverlay = None #This is the part of the image used as hsv overlay
-        self.pdfHSVimg = None  # This is the pdf rendered to an opencv HSV image
+        self.imgProjectorFrame = None # The overlay with line thickness and inversion, as projected
+        self.pdfPageImg = None # This is the pdf page as rendered by poppler
         self.Hue_offset_current = 0  # Hue rotation angle from 0 to 179
         self.Hue_offset_target = 0  # Hue rotation angle from 0 to 179
         self.Sat_mult_current = 1  # Saturation multiplier
@@ -417,52 +816,140 @@ class ProjectorPaintWidget(QWidget):
         self.setOffsetRotation(int(self.img.width() / 2), int(self.img.height() / 2), 0)
 
     def setPdfImage(self, pdf_image):
+        self.pdfPageImg = pdf_image
         self.mutexHSV.acquire()
         self.img = pdf_image
         self.mutexHSV.release()
 
-        rawImg = self.img.convertToFormat(QImage.Format_ARGB32)
-        ptr = rawImg.constBits()
-        ptr.setsize(rawImg.height() * rawImg.width() * rawImg.depth() // 8)
-        self.pdfHSVimg = np.ndarray(shape=(rawImg.height(), rawImg.width(), rawImg.depth() // 8), buffer=ptr,
-                                    dtype=np.uint8)
-        self.pdfHSVimg = self.pdfHSVimg[:, :, 0:3]  # Discard alpha channel, the image is reversed so the actual format is BGRA
-        self.pdfHSVimg = cv.cvtColor(self.pdfHSVimg, cv.COLOR_BGR2HSV)
-
-        #Change saturation of the original imatge
-        arr = self.pdfHSVimg.copy()
-        arr[:, :, 1] = cv.multiply(arr[:, :, 1], 0.2)
-        arr = cv.cvtColor(arr, cv.COLOR_HSV2BGR)
-
-        alphaChannel = np.full((arr.shape[0], arr.shape[1], 1), 255, dtype=np.uint8)
-        arr = np.concatenate((arr, alphaChannel), axis=2)
+        self.composer.setPage(self.image2BGR(self.img))
+        self.scheduleRefine() # New page or layers, the refined region was dropped with the old page
+
+        arr = frameComposer.previewImage(self.composer.getPageHSV())
         self.img = QImage(arr.tobytes(), arr.shape[1], arr.shape[0], QImage.Format_ARGB32)
         self.bForceRedrawByTimmer = True  # Force redraw in the next cycle
 
+    def image2BGR(self, qimg):
+        rawImg = qimg.convertToFormat(QImage.Format_ARGB32)
+        ptr = rawImg.constBits()
+        ptr.setsize(rawImg.height() * rawImg.width() * rawImg.depth() // 8)
+        arr = np.ndarray(shape=(rawImg.height(), rawImg.width(), rawImg.depth() // 8), buffer=ptr,
+                         dtype=np.uint8)
+        return cv.cvtColor(arr, cv.COLOR_BGRA2BGR)  # The image is reversed so the actual format is BGRA
+
+    def getViewState(self):
+        # Immutable copy of the current view for the frame composer
+        return frameComposer.ViewState(xoffset=float(self.xoffset), yoffset=float(self.yoffset),
+                                       rotation=float(self.rotation), mirror=self.bMirror,
+                                       hue_offset=self.Hue_offset_target, sat_multiplier=self.Sat_mult_target,
+                                       val_multiplier=self.Val_mult_target, thickness=self.Line_Thickness,
+                                       invert=self.bInvertColorsProjector,
+                                       frame_width=self.renderWidth, frame_height=self.renderHeight,
+                                       interactive=self.bInteractive)
+
+    def setRefinedImage(self, pdf_image, xorigin, yorigin, factor):
+        # A region of the page rendered at factor times the render DPI, origin in rendered page pixels
+        self.composer.setRefinedRegion(self.image2BGR(pdf_image), xorigin, yorigin, factor)
+        self.bForceRedrawByTimmer = True
+
+    def getVisiblePageRegion(self):
+        # Bounding box (x, y, w, h) of the projected area in rendered page pixels, before mirroring
+        pageHSV = self.composer.getPageHSV()
+        if pageHSV is None:
+            return None
+        return frameComposer.visiblePageRegion(self.getViewState(), pageHSV.shape)
+
+    def markInteraction(self):
+        self.bInteractive = True
+        self.scheduleRefine()
+
+    def scheduleRefine(self):
+        # Any change that drops the refined region must bring it back after the idle delay
+        self.timerRefine.start(self.refineIdleDelay)
+
+    def timer_refine(self):
+        # The user stopped interacting, compute a full quality frame
+        self.bInteractive = False
+        self.bForceRedrawByTimmer = True
+        if not self.composer.hasRefinedRegion() and not self.bVectorMode: # Still valid if only the colors changed
+            self.refine_requested.emit()
+
+    def setVectorMode(self, bVectorMode):
+        self.bVectorMode = bVectorMode
+        self.vectorViewState = None
+        if not bVectorMode:
+            self.projectorWindow.clearVectorView()
+
+    def setVectorPage(self, vectorPage):
+        self.vectorPage = vectorPage
+
+    def setHiddenLayers(self, names):
+        self.hiddenLayers = frozenset(names)
+
+    def updateVectorProjection(self):
+        # Draws the line art on the projector window when the view has changed since the last call
+        pageHSV = self.composer.getPageHSV()
+        if self.vectorPage is None or pageHSV is None:
+            return
+        stateTime = time.perf_counter()
+        view = self.getViewState()
+        vectorViewState = (replace(view, interactive=False), self.vectorPage, self.hiddenLayers)
+        if vectorViewState == self.vectorViewState:
+            return
+        self.vectorViewState = vectorViewState
+        # Same mapping as the raster warp, from rendered page pixels to frame pixels
+        m = frameComposer.frameMatrix(view, pageHSV.shape[1])
+        frameTransform = QTransform(float(m[0][0]), float(m[1][0]), float(m[0][1]), float(m[1][1]),
+                                    float(m[0][2]), float(m[1][2]))
+        self.projectorWindow.setVectorView(self.vectorPage, frameTransform, view, self.hiddenLayers)
+        self.vectorFrameStateTime = stateTime
+        self.vector_frame_drawn.emit()
+
+    def setViewState(self, xoff, yoff, angle, scale):
+        # Restores a saved view, the scale is not clamped as the widget may not be laid out yet
+        self.scale = scale
+        self.setOffsetRotation(xoff, yoff, angle)
+
+    def getSessionBuffers(self):
+        # Returns the rendered page and the last projected frame as numpy arrays
+        if self.pdfPageImg is None:
+            return None
+        return snapshot.qimage2array(self.pdfPageImg), snapshot.qimage2array(self.projectorWindow.img)
+
     def setMirror(self, bMirror):
         self.bMirror = bMirror
+        self.composer.clearRefinedRegion()
+        self.composer.clearCachedFrames()
+        self.scheduleRefine()
         self.bForceRedrawByTimmer = True
 
     def setInvertColors(self, bInvertProjector, bInvertPreview):
         self.bInvertColorsProjector = bInvertProjector
         self.bInvertColorsPreviewer = bInvertPreview
+        self.composer.clearCachedFrames()
         self.bForceRedrawByTimmer = True
 
     def setOffsetRotation(self, xoff, yoff, angle):
+        if xoff != self.xoffset or yoff != self.yoffset:
+            self.composer.clearCachedFrames() # A rotation alone keeps the speculated snap frames
         self.xoffset = xoff
         self.yoffset = yoff
         self.rotation = angle
+        self.composer.clearRefinedRegion()
+        self.scheduleRefine() # Also covers resetOffsetRotation and setViewState
         self.bForceRedrawByTimmer = True
 
     def setHSVColorEffects(self, hue_offset, sat_multiplier, val_multipler ):
         self.Hue_offset_target = hue_offset
         self.Sat_mult_target = sat_multiplier
         self.Val_mult_target = val_multipler
+        self.composer.clearCachedFrames()
+        self.markInteraction()
         # The redraw is handled byt the hsv redraw timmer, nothing to do here
 
     def setThickness(self, thickness_value):
         self.Line_Thickness = thickness_value
-        self.repaint()
+        self.composer.clearCachedFrames()
+        self.bForceRedrawByTimmer = True
 
     def setScale(self, scale):
         max_scale_w = self.width() / self.renderWidth
@@ -475,6 +962,7 @@ class ProjectorPaintWidget(QWidget):
         self.bForceRedrawByTimmer = True
 
     def movePattern(self, xdelta, ydelta, bRotationMode, bSlow):
+        self.markInteraction()
         if bRotationMode:
             if bSlow:
                 self.setOffsetRotation(self.xoffset, self.yoffset, self.rotation-ydelta*0.2)
@@ -482,8 +970,7 @@ class ProjectorPaintWidget(QWidget):
             else:
                 self.rotation_delta_cumulative = self.rotation_delta_cumulative + ydelta
                 if math.fabs(self.rotation_delta_cumulative) > 60:
-                    angle = math.floor(self.rotation / 45) * 45
-                    angle = angle + 45.0*(math.fabs(self.rotation_delta_cumulative)/self.rotation_delta_cumulative)
+                    angle = frameComposer.snapRotation(self.rotation, math.copysign(1, self.rotation_delta_cumulative))
                     self.rotation_delta_cumulative = 0.0
                     self.setOffsetRotation(self.xoffset, self.yoffset, angle)
         else:
@@ -506,6 +993,7 @@ class ProjectorPaintWidget(QWidget):
 
     def mousePressEvent(self, event):
         self.setMouseTracking(True)
+        self.bMousePressed = True
         self.prev_xevent = event.x()
         self.prev_yevent = event.y()
         # Override the mousePressEvent to customize behavior
@@ -517,6 +1005,7 @@ class ProjectorPaintWidget(QWidget):
 
     def mouseReleaseEvent(self, event):
         self.setMouseTracking(False)
+        self.bMousePressed = False
         if self.bSlowMode:
             self.setCursor(Qt.PointingHandCursor)
         else:
@@ -537,6 +1026,7 @@ class ProjectorPaintWidget(QWidget):
             self.setScale(self.scale * 0.9)
         #print(f"Wheel delta: ({event.angleDelta().y()})")
     def offsetImageArrowKeys(self, xdelta, ydelta):
+        self.markInteraction()
         xdiffrotated = xdelta * math.cos(self.rotation * math.pi / 180) + ydelta * math.sin(self.rotation * math.pi / 180)
         ydiffrotated = -xdelta * math.sin(self.rotation * math.pi / 180) + ydelta * math.cos(self.rotation * math.pi / 180)
         self.setOffsetRotation(int((self.xoffset - xdiffrotated / self.scale)),
@@ -563,59 +1053,78 @@ class ProjectorPaintWidget(QWidget):
     def closeEvent(self, event):
         if self.threadHSVRecompute.is_alive():
             self.threadHSVRecompute.join()
+        if self.threadSpeculate.is_alive():
+            self.threadSpeculate.join()
         self.projectorWindow.setCloseFlag()
         self.projectorWindow.close()
         event.accept()
 
     def timer_delay_hsvredraw(self):
+        if self.bVectorMode:
+            self.updateVectorProjection() # Not bound to the raster recompute below, that one only feeds the preview
         if not self.threadHSVRecompute.is_alive():
             if self.bRedrawHSVImage:
-                self.bForceRedrawByTimmer = False
                 self.bRedrawHSVImage = False
                 self.threadHSVRecompute.join()
-                self.repaint()
+                self.pushComposedFrame()
             if (((self.Hue_offset_current != self.Hue_offset_target) or
                     (self.Sat_mult_current != self.Sat_mult_target) or
                     (self.Val_mult_current != self.Val_mult_target)) or
                     self.bForceRedrawByTimmer):
-                self.threadHSVRecompute = threading.Thread(target=self.thread_hsvRecompute)
-                self.threadHSVRecompute.start()
-
-    def thread_hsvRecompute(self):
-        self.bRedrawHSVImage = True
-        if self.pdfHSVimg is not None:
-            hueoffset = self.Hue_offset_target
-            satmult = self.Sat_mult_target
-            valmult = self.Val_mult_target
-
-            #Pre-mirror
-            if self.bMirror:
-                arr = cv.flip(self.pdfHSVimg, 1)
-            else:
-                arr = self.pdfHSVimg
-
-            # Offset and rotation on the projector overlay
-            rotMat = cv.getRotationMatrix2D((self.xoffset, self.yoffset), -self.rotation, 1.0)
-            rotMat[0][2] += (self.renderWidth / 2) - self.xoffset
-            rotMat[1][2] += (self.renderHeight / 2) - self.yoffset
-            arr = cv.warpAffine(arr, rotMat, (self.renderWidth, self.renderHeight),
-                                borderMode=cv.BORDER_CONSTANT, borderValue=(0, 0, 255)) #Caution! the Border color is in HSV!
-
-            arr[:, :, 0] = arr[:, :, 0] + hueoffset #Using this method instead of cv.add to get built-in overflo0w for color rotation
-            arr[:, :, 1] = cv.multiply(arr[:, :, 1], satmult)
-            arr[:, :, 2] = cv.multiply(arr[:, :, 2], valmult)
-
-            arr = cv.cvtColor(arr, cv.COLOR_HSV2BGR)
-            alphaChannel = np.full((arr.shape[0], arr.shape[1], 1), 255, dtype=np.uint8)
-            arr = np.concatenate((arr, alphaChannel), axis=2)
-
+                self.bForceRedrawByTimmer = False # Cleared at start so changes during the recompute are not lost
+                self.frameStateTime = time.perf_counter()
+                view = self.getViewState()
+                self.composer.retainCachedFrames(view)
+                cached = None if self.composer.hasRefinedRegion() else self.composer.cachedFrame(view)
+                if cached is not None:
+                    # Already composed, like a snap rotation computed speculatively, just swap the buffers
+                    self.setComposedFrame(replace(view, interactive=False), *cached)
+                    self.pushComposedFrame()
+                else:
+                    self.threadHSVRecompute = threading.Thread(target=self.thread_hsvRecompute)
+                    self.threadHSVRecompute.start()
+            elif (not self.bVectorMode and not self.threadSpeculate.is_alive() and
+                    self.composer.getPageHSV() is not None and (not self.bInteractive or self.isRotationDrag())):
+                # Nothing to recompute while still or rotating, prepare the frames of the next rotation snap
+                view = self.getViewState()
+                for snapView in frameComposer.snapNeighbourViews(view):
+                    if not self.composer.hasCachedFrame(snapView):
+                        self.threadSpeculate = threading.Thread(target=self.composer.speculate, args=(snapView,))
+                        self.threadSpeculate.start()
+                        break
+
+    def isRotationDrag(self):
+        # Right button drag on the viewer or on the projector window
+        return ((self.bMousePressed and self.dragModeIsRotation) or
+                (self.projectorWindow.bRightButton and not self.projectorWindow.bLeftButton))
+
+    def pushComposedFrame(self):
+        if self.imgProjectorFrame is not None:
             self.mutexHSV.acquire()
-            self.imgHSVOverlay = QImage(arr.tobytes(), arr.shape[1], arr.shape[0], QImage.Format_ARGB32)
+            frameImg = self.imgProjectorFrame
+            bInteractive = self.bFrameInteractive
             self.mutexHSV.release()
+            self.projectorWindow.redraw(frameImg, not bInteractive)
+        self.repaint()
+        self.frame_composed.emit()
+
+    def setComposedFrame(self, view, overlay, frame):
+        self.mutexHSV.acquire()
+        self.imgHSVOverlay = QImage(overlay.tobytes(), overlay.shape[1], overlay.shape[0], QImage.Format_ARGB32)
+        self.imgProjectorFrame = QImage(frame.tobytes(), frame.shape[1], frame.shape[0], QImage.Format_ARGB32)
+        self.bFrameInteractive = view.interactive
+        self.mutexHSV.release()
 
-            self.Hue_offset_current = hueoffset
-            self.Sat_mult_current = satmult
-            self.Val_mult_current = valmult
+        self.Hue_offset_current = view.hue_offset
+        self.Sat_mult_current = view.sat_multiplier
+        self.Val_mult_current = view.val_multiplier
+
+    def thread_hsvRecompute(self):
+        self.bRedrawHSVImage = True
+        view = self.getViewState()
+        composed = self.composer.compose(view)
+        if composed is not None:
+            self.setComposedFrame(view, *composed)
 
     def paintEvent(self, event):
         qp = QPainter(self)
@@ -653,9 +1162,6 @@ class ProjectorPaintWidget(QWidget):
             drawImg = self.imgHSVOverlay.copy()
             self.mutexHSV.release()
 
-            # Redraw the projector window
-            self.projectorWindow.redraw(drawImg, self.bInvertColorsProjector, self.Line_Thickness)
-
             if self.bInvertColorsPreviewer:
                 drawImg.invertPixels()
             qp.drawPixmap(-drawImg.width()//2, -drawImg.height()//2, QPixmap.fromImage(drawImg))
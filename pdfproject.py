@@ -28,6 +28,10 @@ Load a PDF and display the first page.
 Usage:
 
     python pdfproject.py file.pdf
+
+Record the input of the session to replay it with session_replay.py:
+
+    python pdfproject.py --record session.jsonl file.pdf
 """
 
 if __name__ == '__main__':
@@ -40,5 +44,10 @@ if __name__ == '__main__':
 
     viewerScreen = my_screens[0]
     argv = QApplication.arguments()
-    ex = ProjectorApp.AppPDFProjector(viewerScreen, projectorScreen, argv)
+    recordFile = None
+    if '--record' in argv[:-1]:
+        i = argv.index('--record')
+        recordFile = argv[i + 1]
+        del argv[i:i + 2]
+    ex = ProjectorApp.AppPDFProjector(viewerScreen, projectorScreen, argv, recordFile)
     sys.exit(app.exec_())
@@ -17,17 +17,25 @@
 ############################################################################
 
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPainter, QPixmap, QImage
-from PyQt5.QtCore import Qt, pyqtSignal
-import numpy as np
-import cv2 as cv
+from PyQt5.QtGui import QPainter, QPixmap, QTransform
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal
 import py_compile
 
+import vector_paths as vecPaths
+
 class ProjectorWindow(QWidget):
     mouse_move = pyqtSignal(float, float, bool, bool, bool) #xdelta, ydelta, leftbutton, rightbutton, slowmode
     arrow_key = pyqtSignal(object)
     def __init__(self, projectorScreen, projectorWidth, projectorHeight, bfullscreen, renderDPI, projectorXDPI, projectorYDPI):
         self.binvertcolors = False
+        self.bSmooth = True
+        self.vectorPage = None # When set, the line art is drawn instead of the raster frame
+        self.vectorTransform = None
+        self.vectorColors = {}
+        self.vectorHSVEffects = (0, 1, 1)
+        self.vectorPenWidth = 1.0
+        self.vectorGrowWidth = 0.0
+        self.vectorHiddenLayers = frozenset()
         self.bclose = False
         self.prev_xevent = 0
         self.prev_yevent = 0
@@ -46,8 +54,6 @@ class ProjectorWindow(QWidget):
         self.setFixedHeight(projectorHeight)
         if bfullscreen:
             self.showFullScreen()
-        erode_size = 3 #Must be odd to have a center in order to grow from the line center
-        self.erode_ker = cv.getStructuringElement(cv.MORPH_ELLIPSE, (erode_size, erode_size)) #Works smoother using a circle
         self.setCursor(Qt.OpenHandCursor)
 
     def setCloseFlag(self):
@@ -100,27 +106,57 @@ class ProjectorWindow(QWidget):
             self.bSlowMode = False
             self.setCursor(Qt.OpenHandCursor)
 
-    def redraw(self, newImg, bInvertColors, iLineGrow):
-        self.binvertcolors = bInvertColors
-
-        newImg = newImg.convertToFormat(QImage.Format_ARGB32)
-        ptr = newImg.constBits()
-        ptr.setsize(newImg.height() * newImg.width() * newImg.depth() // 8)
-        arr_drwcvimg = np.ndarray(shape=(newImg.height(), newImg.width(), newImg.depth() // 8), buffer=ptr,
-                                    dtype=np.uint8)
-
-        if iLineGrow > 0:
-            arr_drwcvimg = cv.erode(src=arr_drwcvimg, kernel=self.erode_ker, iterations=iLineGrow, anchor=(-1,-1),
-                                    borderType=cv.BORDER_CONSTANT, borderValue = 1)
+    def redraw(self, frameImg, bSmooth=True):
+        # frameImg is the composed frame, with line thickness and color inversion already applied
+        self.img = frameImg
+        self.bSmooth = bSmooth # Smooth scaling to the projector resolution, skipped on interactive frames
+        if self.vectorPage is None: # The raster frame is still kept up to date in vector mode
+            self.repaint()
 
-        self.img = QImage(arr_drwcvimg.tobytes(), arr_drwcvimg.shape[1], arr_drwcvimg.shape[0], QImage.Format_ARGB32)
+    def showFrame(self, frameImg):
+        # Displays an already composed frame (thickness and inversion applied), used to restore a previous session
+        self.img = frameImg
+        self.repaint()
 
-        if self.binvertcolors:
-            self.img.invertPixels()
+    def setVectorView(self, vectorPage, frameTransform, view, hiddenLayers):
+        # frameTransform maps rendered page pixels to frame pixels, as the raster warp does
+        hsvEffects = (view.hue_offset, view.sat_multiplier, view.val_multiplier)
+        if vectorPage is not self.vectorPage or hsvEffects != self.vectorHSVEffects or view.invert != self.binvertcolors:
+            self.vectorColors = {}
+        self.vectorPage = vectorPage
+        self.vectorTransform = frameTransform * QTransform.fromScale(self.xScaleFactor, self.yScaleFactor)
+        self.vectorHSVEffects = hsvEffects
+        self.binvertcolors = view.invert
+        self.vectorPenWidth = max(1.0, (1 + 2 * view.thickness) * self.xScaleFactor) # Erode grows a pixel per side
+        self.vectorGrowWidth = 2 * view.thickness * self.xScaleFactor
+        self.vectorHiddenLayers = hiddenLayers
+        self.repaint()
 
+    def clearVectorView(self):
+        self.vectorPage = None
         self.repaint()
 
+    def mapVectorColor(self, rgb):
+        if rgb not in self.vectorColors:
+            hue, sat, val = self.vectorHSVEffects
+            self.vectorColors[rgb] = vecPaths.hsvColorEffect(rgb, hue, sat, val, self.binvertcolors)
+        return self.vectorColors[rgb]
+
+    def paintVector(self, qp):
+        # White paper as in the raster frame, with the same color effects
+        qp.fillRect(self.rect(), self.mapVectorColor((1.0, 1.0, 1.0)))
+        qp.setRenderHint(QPainter.Antialiasing)
+        qp.setTransform(self.vectorTransform)
+        visibleRect = self.vectorTransform.inverted()[0].mapRect(QRectF(self.rect()))
+        self.vectorPage.draw(qp, visibleRect, self.vectorHiddenLayers, self.mapVectorColor,
+                             self.vectorPenWidth, self.vectorGrowWidth)
+
     def paintEvent(self, event):
         qp = QPainter(self)
+        if self.vectorPage is not None:
+            self.paintVector(qp)
+            return
+        if self.bSmooth:
+            qp.setRenderHint(QPainter.SmoothPixmapTransform)
         qp.scale(self.xScaleFactor, self.yScaleFactor)
         qp.drawPixmap(0,0, QPixmap.fromImage(self.img))
@@ -0,0 +1,288 @@
+#########################################################################
+#     PatternPDFProjector - PDF Viewer for sewing pattern projection
+#     Copyright (C) 2024 Pere Rafols Soler
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# Poppler rendering in worker processes. Each worker opens the document once and renders pages or
+# page regions into shared memory blocks, so the pixels reach the GUI process without being pickled.
+
+import heapq
+import itertools
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from dataclasses import dataclass
+
+from PyQt5.QtCore import Qt, QModelIndex
+import numpy as np
+
+PRIORITY_PROJECTED = 0 # Needed by the projector frame
+PRIORITY_VISIBLE = 1 # Shown in the viewer
+PRIORITY_BACKGROUND = 2 # Prefetch
+
+MAX_JOB_ATTEMPTS = 2 # A job that kills its worker twice is dropped
+MAX_CONSECUTIVE_CRASHES = 6 # Without a render in between, the farm gives up and isAvailable() turns False
+RESPAWN_DELAY = 0.25 # Seconds before replacing a crashed worker, doubled on each consecutive crash
+
+@dataclass
+class RenderJob:
+    page: int
+    xres: float
+    yres: float
+    region: tuple = None # (x, y, w, h) in pixels at xres, yres. None renders the whole page
+    layer_states: tuple = None # Optional content check states in depth-first order, None keeps the worker ones
+    priority: int = PRIORITY_BACKGROUND # Lower first, newest first within the same priority
+    tag: object = None # Returned untouched with the result
+    job_id: int = -1
+    attempts: int = 0
+
+def optionalContentIndexes(model):
+    # All the items of a poppler optional content model in depth-first order
+    indexes = []
+    parents = [QModelIndex()]
+    while parents:
+        parent = parents.pop()
+        for row in reversed(range(model.rowCount(parent))):
+            parents.append(model.index(row, 0, parent))
+        if parent.isValid():
+            indexes.append(parent)
+    return indexes
+
+def applyLayerStates(pdfdoc, states):
+    if not pdfdoc.hasOptionalContent():
+        return
+    model = pdfdoc.optionalContentModel()
+    indexes = optionalContentIndexes(model)
+    if len(indexes) != len(states):
+        return
+    for idx, state in zip(indexes, states):
+        if state is not None and int(idx.data(Qt.CheckStateRole)) != state:
+            model.setData(idx, state, Qt.CheckStateRole)
+
+def workerMain(conn, pdf_filename):
+    import popplerqt5
+    from PyQt5.QtGui import QImage
+
+    pdfdoc = popplerqt5.Poppler.Document.load(pdf_filename)
+    pdfdoc.setRenderHint(popplerqt5.Poppler.Document.Antialiasing)
+    pdfdoc.setRenderHint(popplerqt5.Poppler.Document.TextAntialiasing)
+    layerStates = None
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        job_id, page, xres, yres, region, layer_states, bRetire = msg
+        if layer_states is not None and layer_states != layerStates:
+            applyLayerStates(pdfdoc, layer_states)
+            layerStates = layer_states
+
+        pageImg = pdfdoc.page(page)
+        if region is None:
+            img = pageImg.renderToImage(xres, yres)
+        else:
+            img = pageImg.renderToImage(xres, yres, *region)
+        img = img.convertToFormat(QImage.Format_ARGB32)
+        if img.isNull():
+            conn.send((job_id, None, None))
+        else:
+            shape = (img.height(), img.width(), 4)
+            shm = shared_memory.SharedMemory(create=True, size=img.height() * img.bytesPerLine())
+            ptr = img.constBits()
+            ptr.setsize(img.height() * img.bytesPerLine())
+            np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)[:] = np.ndarray(shape, dtype=np.uint8, buffer=ptr)
+            conn.send((job_id, shm.name, shape)) # The GUI process unlinks the block
+            shm.close()
+        if bRetire:
+            break
+
+class RenderWorker:
+    def __init__(self, ctx, pdf_filename):
+        self.conn, childConn = ctx.Pipe()
+        self.process = ctx.Process(target=workerMain, args=(childConn, pdf_filename), daemon=True)
+        self.process.start()
+        childConn.close()
+        self.job = None # Job being rendered
+        self.bRetiring = False
+        self.jobsDone = 0
+        self.bDead = False # Crashed, replaced at respawnTime
+        self.respawnTime = 0.0
+
+class RenderFarm:
+    def __init__(self, pdf_filename, numWorkers, maxJobsPerWorker):
+        self.ctx = mp.get_context('spawn') # Forking a process running Qt is not safe
+        self.pdf_filename = pdf_filename
+        self.maxJobsPerWorker = maxJobsPerWorker # Workers are recycled to contain poppler memory growth
+        self.workers = [RenderWorker(self.ctx, pdf_filename) for _ in range(numWorkers)]
+        self.queue = [] # Heap of (priority, -order, job_id), stale entries are skipped when popped
+        self.jobs = {} # Pending and running jobs by id, a cancelled job is removed from here
+        self.ids = itertools.count()
+        self.order = itertools.count()
+        self.crashes = 0 # Consecutive worker crashes, reset by any rendered job
+        self.failedJobs = [] # Jobs dropped after MAX_JOB_ATTEMPTS or with an empty render
+
+    def submit(self, job):
+        job.job_id = next(self.ids)
+        self.jobs[job.job_id] = job
+        heapq.heappush(self.queue, (job.priority, -next(self.order), job.job_id))
+        self.dispatch()
+        return job.job_id
+
+    def setPriority(self, job_id, priority):
+        # Also moves the job in front of the ones with the same priority
+        job = self.jobs.get(job_id)
+        if job is None or self.isRunning(job_id):
+            return
+        job.priority = priority
+        heapq.heappush(self.queue, (priority, -next(self.order), job_id))
+
+    def cancel(self, job_id):
+        # A running job cannot be interrupted, its result is discarded
+        self.jobs.pop(job_id, None)
+
+    def cancelWhere(self, predicate):
+        for job_id in [job_id for job_id, job in self.jobs.items() if predicate(job)]:
+            self.cancel(job_id)
+
+    def isPending(self, job_id):
+        return job_id in self.jobs
+
+    def isAvailable(self):
+        # False once the workers keep crashing, for instance if they cannot open the document
+        return self.crashes < MAX_CONSECUTIVE_CRASHES
+
+    def takeFailedJobs(self):
+        failed = self.failedJobs
+        self.failedJobs = []
+        return failed
+
+    def isRunning(self, job_id):
+        return any(worker.job is not None and worker.job.job_id == job_id for worker in self.workers)
+
+    def nextJob(self):
+        while self.queue:
+            priority, _, job_id = heapq.heappop(self.queue)
+            job = self.jobs.get(job_id)
+            if job is not None and job.priority == priority and not self.isRunning(job_id):
+                return job
+        return None
+
+    def dispatch(self):
+        for worker in self.workers:
+            if worker.job is not None or worker.bRetiring or worker.bDead:
+                continue
+            job = self.nextJob()
+            if job is None:
+                return
+            worker.job = job
+            worker.jobsDone += 1
+            worker.bRetiring = worker.jobsDone >= self.maxJobsPerWorker
+            worker.conn.send((job.job_id, job.page, job.xres, job.yres, job.region, job.layer_states, worker.bRetiring))
+
+    def receive(self, worker):
+        job_id, shm_name, shape = worker.conn.recv()
+        arr = None
+        if shm_name is not None:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            arr = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).copy()
+            shm.close()
+            shm.unlink()
+        job = worker.job
+        worker.job = None
+        self.crashes = 0
+        if self.jobs.pop(job_id, None) is None:
+            return None # Cancelled
+        if arr is None:
+            self.failedJobs.append(job)
+            return None
+        return job, arr
+
+    def replaceWorker(self, i):
+        self.workers[i].process.join(1)
+        self.workers[i] = RenderWorker(self.ctx, self.pdf_filename)
+
+    def workerCrashed(self, i):
+        # Schedules the replacement of a dead worker and retries its job in the new one
+        worker = self.workers[i]
+        job = worker.job
+        worker.job = None
+        while True:
+            # Free the shared memory of a result sent right before dying
+            try:
+                if not worker.conn.poll():
+                    break
+                _, shm_name, _ = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            if shm_name is not None:
+                try:
+                    shm = shared_memory.SharedMemory(name=shm_name)
+                    shm.close()
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(1)
+        self.crashes += 1
+        worker.bDead = True
+        worker.respawnTime = time.monotonic() + RESPAWN_DELAY * 2 ** (self.crashes - 1)
+        if job is not None and job.job_id in self.jobs:
+            job.attempts += 1
+            if job.attempts < MAX_JOB_ATTEMPTS:
+                heapq.heappush(self.queue, (job.priority, -next(self.order), job.job_id))
+            else:
+                self.failedJobs.append(self.jobs.pop(job.job_id))
+
+    def poll(self):
+        # Returns the finished (job, BGRA array) pairs, call it often from the GUI thread
+        results = []
+        for i, worker in enumerate(self.workers):
+            if worker.bDead:
+                if self.isAvailable() and time.monotonic() >= worker.respawnTime:
+                    self.replaceWorker(i)
+                continue
+            if worker.job is not None and worker.conn.poll():
+                try:
+                    result = self.receive(worker)
+                except (EOFError, OSError):
+                    # The pipe of a dead worker is always readable, recv() fails on it
+                    self.workerCrashed(i)
+                    continue
+                if result is not None:
+                    results.append(result)
+                if worker.bRetiring:
+                    self.replaceWorker(i)
+            elif not worker.process.is_alive():
+                # Crashed while idle or without closing the pipe yet
+                self.workerCrashed(i)
+        self.dispatch()
+        return results
+
+    def shutdown(self):
+        self.jobs.clear()
+        self.queue = []
+        for worker in self.workers:
+            try:
+                if worker.job is not None and worker.conn.poll(1):
+                    self.receive(worker) # Unlinks the shared memory of the last result
+                worker.conn.send(None)
+            except (EOFError, OSError, BrokenPipeError):
+                pass
+        for worker in self.workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self.workers = []
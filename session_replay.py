@@ -0,0 +1,352 @@
+#########################################################################
+#     PatternPDFProjector - PDF Viewer for sewing pattern projection
+#     Copyright (C) 2024 Pere Rafols Soler
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# Record the user input of a projector session and replay it offscreen to measure the input to frame latency.
+# A recording is a json lines file: a header with the document and the initial state, then one line per input.
+
+import os
+import sys
+import json
+import time
+import argparse
+import xml.etree.ElementTree as ET
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QObject, QEvent, QEventLoop, QElapsedTimer, QPoint, QPointF
+from PyQt5.QtGui import QMouseEvent, QWheelEvent, QKeyEvent
+import numpy as np
+
+import session_snapshot as snapshot
+
+RECORDING_VERSION = 1
+
+MOUSE_EVENTS = {QEvent.MouseButtonPress: 'mouse_press',
+                QEvent.MouseButtonRelease: 'mouse_release',
+                QEvent.MouseMove: 'mouse_move'}
+KEY_EVENTS = {QEvent.KeyPress: 'key_press',
+              QEvent.KeyRelease: 'key_release'}
+
+usage = """
+Replay a recorded session offscreen and report the input to frame latency.
+
+Record a session with:
+
+    python pdfproject.py --record session.jsonl file.pdf
+
+Replay it with:
+
+    python session_replay.py session.jsonl file.pdf
+"""
+
+def sliderWidgets(app):
+    return {'hue': app.sliderHue,
+            'saturation': app.sliderSaturation,
+            'value': app.sliderValue,
+            'thickness': app.sliderThickness}
+
+def buttonWidgets(app):
+    # Checkable buttons and the slot their clicked signal runs
+    return {'mirror': (app.BtnMirror, app.mirror_btn_clicked),
+            'invert_colors': (app.BtnInvertColors, app.invertcolors_btn_clicked),
+            'invert_both': (app.checkBoxInvertBoth, app.invertcolors_btn_clicked),
+            'vector': (app.BtnVectorMode, app.vector_btn_clicked)}
+
+def inputTargets(app):
+    return {'viewer': app.projectorWidget,
+            'projector': app.projectorWidget.projectorWindow}
+
+class InputRecorder(QObject):
+    # Writes every input of the viewer and projector windows, flushed per line so a crash keeps the recording
+    def __init__(self, filename, app):
+        super().__init__()
+        self.file = open(filename, 'w')
+        self.elapsed = QElapsedTimer()
+        self.elapsed.start()
+        self.targets = inputTargets(app)
+        self.targetNames = {id(target): name for name, target in self.targets.items()}
+        self.fingerprint = app.pdf_fingerprint
+        self.writeLine({'type': 'header',
+                        'version': RECORDING_VERSION,
+                        'state': app.getSessionState()})
+        for target in self.targets.values():
+            target.installEventFilter(self)
+        for name, slider in sliderWidgets(app).items():
+            slider.valueChanged.connect(lambda value, name=name: self.record({'type': 'slider', 'name': name, 'value': value}))
+        for name, (button, _) in buttonWidgets(app).items():
+            button.clicked.connect(lambda checked, name=name: self.record({'type': 'button', 'name': name, 'checked': checked}))
+
+    def writeLine(self, entry):
+        if self.file is None:
+            return
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def record(self, entry):
+        entry['t'] = self.elapsed.nsecsElapsed() / 1e9
+        self.writeLine(entry)
+
+    def eventFilter(self, obj, event):
+        target = self.targetNames.get(id(obj))
+        if target is not None:
+            if event.type() in MOUSE_EVENTS:
+                self.record({'type': MOUSE_EVENTS[event.type()], 'target': target,
+                             'x': event.x(), 'y': event.y(),
+                             'button': int(event.button()), 'buttons': int(event.buttons()),
+                             'modifiers': int(event.modifiers())})
+            elif event.type() == QEvent.Wheel:
+                self.record({'type': 'wheel', 'target': target,
+                             'x': event.pos().x(), 'y': event.pos().y(),
+                             'delta': event.angleDelta().y(),
+                             'buttons': int(event.buttons()), 'modifiers': int(event.modifiers())})
+            elif event.type() in KEY_EVENTS:
+                self.record({'type': KEY_EVENTS[event.type()], 'target': target,
+                             'key': event.key(), 'modifiers': int(event.modifiers()),
+                             'auto_repeat': event.isAutoRepeat()})
+        return False # Never consume the event
+
+    def close(self):
+        for target in self.targets.values():
+            target.removeEventFilter(self)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def loadRecording(filename):
+    # Returns (header, inputs) with the input times relative to the first one
+    with open(filename) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if not entries or entries[0].get('type') != 'header' or entries[0].get('version') != RECORDING_VERSION:
+        raise ValueError('Not a session recording: ' + filename)
+    header, inputs = entries[0], entries[1:]
+    if inputs:
+        t0 = inputs[0]['t']
+        for entry in inputs:
+            entry['t'] -= t0
+    return header, inputs
+
+class LatencyMeter:
+    # Matches each frame shown on the projector with the inputs it reflects. In vector mode the projector
+    # draws the line art and the composed raster frames only feed the viewer, so those are not counted.
+    def __init__(self, projectorWidget):
+        self.projectorWidget = projectorWidget
+        self.pending = [] # (input time, input type) not shown yet
+        self.latencies = [] # (input type, seconds)
+        self.framesProduced = 0
+        self.framesVector = 0 # Part of framesProduced drawn by the vector projection
+        self.framesUnprompted = 0 # Frames not caused by an input, like the idle refinement
+        self.inputsCoalesced = 0 # Inputs shown by a frame that also shows a later input
+        self.inputsIgnored = 0 # Inputs that did not request a frame
+        projectorWidget.frame_composed.connect(self.frame_composed)
+        projectorWidget.vector_frame_drawn.connect(self.vector_frame_drawn)
+
+    def addInput(self, tInput, kind):
+        self.pending.append((tInput, kind))
+
+    def isVectorProjection(self):
+        return self.projectorWidget.projectorWindow.vectorPage is not None
+
+    def frame_composed(self):
+        if not self.isVectorProjection():
+            self.frameShown(self.projectorWidget.frameStateTime)
+
+    def vector_frame_drawn(self):
+        self.framesVector += 1
+        self.frameShown(self.projectorWidget.vectorFrameStateTime)
+
+    def frameShown(self, tState):
+        tFrame = time.perf_counter()
+        shown = [p for p in self.pending if p[0] <= tState]
+        self.pending = [p for p in self.pending if p[0] > tState]
+        self.framesProduced += 1
+        if not shown:
+            self.framesUnprompted += 1
+        self.inputsCoalesced += max(0, len(shown) - 1)
+        self.latencies.extend((kind, tFrame - tInput) for tInput, kind in shown)
+
+    def report(self):
+        def percentiles(values):
+            ms = 1000.0 * np.array(values)
+            return {'count': len(values),
+                    'p50_ms': float(np.percentile(ms, 50)),
+                    'p95_ms': float(np.percentile(ms, 95)),
+                    'p99_ms': float(np.percentile(ms, 99)),
+                    'max_ms': float(ms.max())}
+        report = {'frames_produced': self.framesProduced,
+                  'frames_vector': self.framesVector,
+                  'frames_unprompted': self.framesUnprompted,
+                  'inputs_measured': len(self.latencies),
+                  'inputs_coalesced': self.inputsCoalesced,
+                  'inputs_ignored': self.inputsIgnored,
+                  'inputs_without_frame': len(self.pending),
+                  'latency': None,
+                  'latency_by_type': {}}
+        if self.latencies:
+            report['latency'] = percentiles([latency for _, latency in self.latencies])
+            for kind in sorted(set(kind for kind, _ in self.latencies)):
+                report['latency_by_type'][kind] = percentiles([latency for k, latency in self.latencies if k == kind])
+        return report
+
+def formatReport(report):
+    lines = ['Frames produced: %d (%d not caused by an input, %d vector projections)' % (
+                 report['frames_produced'], report['frames_unprompted'], report['frames_vector']),
+             'Inputs measured: %d, coalesced: %d, ignored: %d, without frame: %d' % (
+                 report['inputs_measured'], report['inputs_coalesced'],
+                 report['inputs_ignored'], report['inputs_without_frame'])]
+    if report['latency'] is not None:
+        rows = [('all', report['latency'])] + list(report['latency_by_type'].items())
+        lines.append('%-14s %7s %9s %9s %9s %9s' % ('input', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+        for kind, stats in rows:
+            lines.append('%-14s %7d %9.1f %9.1f %9.1f %9.1f' % (kind, stats['count'], stats['p50_ms'],
+                                                               stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+    return '\n'.join(lines)
+
+class InputReplayer:
+    # Feeds a recording to the application with the recorded timing, all in the GUI thread
+    def __init__(self, qapp, app, header, inputs, speed=1.0):
+        self.qapp = qapp
+        self.app = app
+        self.header = header
+        self.inputs = inputs
+        self.speed = speed
+        self.targets = inputTargets(app)
+        self.meter = LatencyMeter(app.projectorWidget)
+
+    def processEvents(self):
+        self.qapp.processEvents(QEventLoop.AllEvents)
+        time.sleep(0.0002) # Leave the GIL to the recompute thread
+
+    def isIdle(self):
+        widget = self.app.projectorWidget
+        return not (self.app.timerDelayRender.isActive() or
+                    widget.composer.getPageHSV() is None or
+                    widget.threadHSVRecompute.is_alive() or
+                    widget.bRedrawHSVImage or
+                    self.requestsFrame() or
+                    widget.timerRefine.isActive() or
+                    self.app.refineJob is not None)
+
+    def waitIdle(self, timeout=10.0):
+        deadline = time.perf_counter() + timeout
+        while not self.isIdle() and time.perf_counter() < deadline:
+            self.processEvents()
+
+    def requestsFrame(self):
+        # True if the application has a frame recompute or a page render queued
+        widget = self.app.projectorWidget
+        return (widget.bForceRedrawByTimmer or
+                widget.Hue_offset_current != widget.Hue_offset_target or
+                widget.Sat_mult_current != widget.Sat_mult_target or
+                widget.Val_mult_current != widget.Val_mult_target or
+                self.app.timerDelayRender.isActive())
+
+    def applyInitialState(self):
+        state = self.header['state']
+        if state['page'] != self.app.pdf_page_idex:
+            self.app.listview_pdfpages.setCurrentIndex(self.app.pagesModel.index(state['page']))
+            self.waitIdle()
+        self.app.applySessionState(state)
+        self.app.setLayerVisibility(state['layers'])
+        self.waitIdle()
+
+    def deliver(self, entry):
+        kind = entry['type']
+        if kind in MOUSE_EVENTS.values():
+            eventType = {name: t for t, name in MOUSE_EVENTS.items()}[kind]
+            event = QMouseEvent(eventType, QPointF(entry['x'], entry['y']), Qt.MouseButton(entry['button']),
+                                Qt.MouseButtons(entry['buttons']), Qt.KeyboardModifiers(entry['modifiers']))
+            QApplication.sendEvent(self.targets[entry['target']], event)
+        elif kind == 'wheel':
+            pos = QPointF(entry['x'], entry['y'])
+            event = QWheelEvent(pos, pos, QPoint(0, 0), QPoint(0, entry['delta']), Qt.MouseButtons(entry['buttons']),
+                                Qt.KeyboardModifiers(entry['modifiers']), Qt.NoScrollPhase, False)
+            QApplication.sendEvent(self.targets[entry['target']], event)
+        elif kind in KEY_EVENTS.values():
+            eventType = {name: t for t, name in KEY_EVENTS.items()}[kind]
+            event = QKeyEvent(eventType, entry['key'], Qt.KeyboardModifiers(entry['modifiers']),
+                              '', entry.get('auto_repeat', False))
+            QApplication.sendEvent(self.targets[entry['target']], event)
+        elif kind == 'slider':
+            sliderWidgets(self.app)[entry['name']].setValue(entry['value'])
+        elif kind == 'button':
+            button, slot = buttonWidgets(self.app)[entry['name']]
+            button.setChecked(entry['checked'])
+            slot()
+        elif kind == 'page':
+            self.app.listview_pdfpages.setCurrentIndex(self.app.pagesModel.index(entry['page']))
+        elif kind == 'layers':
+            self.app.setLayerVisibility(entry['states'])
+
+    def run(self):
+        self.waitIdle()
+        self.applyInitialState()
+        self.meter.framesProduced = self.meter.framesUnprompted = self.meter.framesVector = 0 # Only the replay
+        start = time.perf_counter()
+        for entry in self.inputs:
+            due = start + entry['t'] / self.speed
+            while time.perf_counter() < due:
+                self.processEvents()
+            tInput = time.perf_counter()
+            self.deliver(entry)
+            if self.requestsFrame():
+                self.meter.addInput(tInput, entry['type'])
+            else:
+                self.meter.inputsIgnored += 1
+        self.waitIdle()
+        return self.meter.report()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Replay a recorded projector session and report the input to frame latency.',
+                                     epilog=usage, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='json lines file written by pdfproject.py --record')
+    parser.add_argument('pdf', help='the document the session was recorded with')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 2 replays twice as fast')
+    parser.add_argument('--json', dest='json_report', help='also write the report to this json file')
+    args = parser.parse_args(argv[1:])
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    header, inputs = loadRecording(args.recording)
+    if header['state']['fingerprint'] != snapshot.documentFingerprint(args.pdf):
+        print('Warning: the recording was made with a different document', file=sys.stderr)
+
+    config = ET.parse(os.path.join(os.path.dirname(os.path.abspath(argv[0])), 'config.xml')).getroot()
+    if config.find('fullscreen_mode').text.upper() == 'TRUE':
+        print('Set fullscreen_mode to false in config.xml to replay offscreen', file=sys.stderr)
+        return 1
+
+    import main_win as ProjectorApp
+    qapp = QApplication(argv[:1])
+    screen = qapp.screens()[0]
+    app = ProjectorApp.AppPDFProjector(screen, screen, argv[:1])
+    if (header['state']['render_dpi'] != app.renderDPI or
+            header['state']['projector_width'] != app.projectorWidth or
+            header['state']['projector_height'] != app.projectorHeigth):
+        print('Warning: the recording was made with a different projector calibration', file=sys.stderr)
+    app.sessionSnapshotEnabled = False # Replays start from the recorded state, not from the last session
+    app.pdf_filename = args.pdf
+    app.loadPDF()
+
+    report = InputReplayer(qapp, app, header, inputs, args.speed).run()
+    print(formatReport(report))
+    if args.json_report:
+        with open(args.json_report, 'w') as f:
+            json.dump(report, f, indent=2)
+    app.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,126 @@
+#########################################################################
+#     PatternPDFProjector - PDF Viewer for sewing pattern projection
+#     Copyright (C) 2024 Pere Rafols Soler
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+import os
+import json
+import hashlib
+import zipfile
+import threading
+
+from PyQt5.QtGui import QImage
+import numpy as np
+
+SNAPSHOT_VERSION = 1
+
+# Fingerprint of the pdf file contents, used to match a snapshot with the document it was taken from
+def documentFingerprint(pdf_filename):
+    sha = hashlib.sha1()
+    with open(pdf_filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def qimage2array(img):
+    rawImg = img.convertToFormat(QImage.Format_ARGB32)
+    ptr = rawImg.constBits()
+    ptr.setsize(rawImg.height() * rawImg.width() * rawImg.depth() // 8)
+    arr = np.ndarray(shape=(rawImg.height(), rawImg.width(), rawImg.depth() // 8), buffer=ptr,
+                     dtype=np.uint8)
+    return arr.copy()  # Detach from the QImage memory
+
+def array2qimage(arr):
+    return QImage(arr.tobytes(), arr.shape[1], arr.shape[0], QImage.Format_ARGB32)
+
+class SessionSnapshot:
+    def __init__(self, snapshot_dir, max_files):
+        self.snapshot_dir = os.path.expanduser(snapshot_dir)
+        self.max_files = max_files # Only the most recently saved snapshots are kept
+        self.threadSave = threading.Thread(target=self.thread_save)
+        self.pendingSnapshot = None
+
+    def snapshotPath(self, fingerprint):
+        return os.path.join(self.snapshot_dir, fingerprint + '.npz')
+
+    def isSaving(self):
+        return self.threadSave.is_alive()
+
+    def save(self, state, page_buffer, frame):
+        # Write the snapshot in background, the caller must check isSaving() before calling this
+        self.pendingSnapshot = (state, page_buffer, frame)
+        self.threadSave = threading.Thread(target=self.thread_save)
+        self.threadSave.start()
+
+    def saveNow(self, state, page_buffer, frame):
+        self.wait()
+        self.pendingSnapshot = (state, page_buffer, frame)
+        self.thread_save()
+
+    def wait(self):
+        if self.threadSave.is_alive():
+            self.threadSave.join()
+
+    def thread_save(self):
+        state, page_buffer, frame = self.pendingSnapshot
+        state = dict(state, version=SNAPSHOT_VERSION)
+        path = self.snapshotPath(state['fingerprint'])
+        tmp_path = path + '.tmp'
+        # Write to a temp file and then rename it, so a crash never leaves a half written snapshot
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, state=np.array(json.dumps(state)), page_buffer=page_buffer, frame=frame)
+            os.replace(tmp_path, path)
+            self.prune()
+        except OSError:
+            # Read only or full disk, the snapshot is skipped
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def prune(self):
+        # Removes the oldest snapshots beyond max_files
+        paths = [os.path.join(self.snapshot_dir, name) for name in os.listdir(self.snapshot_dir)
+                 if name.endswith('.npz')]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0, reverse=True)
+        for path in paths[max(1, self.max_files):]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def load(self, fingerprint):
+        # Returns (state, page_buffer, frame) or None if there is no valid snapshot for this document
+        path = self.snapshotPath(fingerprint)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                state = json.loads(str(data['state']))
+                page_buffer = data['page_buffer']
+                frame = data['frame']
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Empty or truncated, remove it so it does not fail again on every load
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        if state.get('version') != SNAPSHOT_VERSION or state.get('fingerprint') != fingerprint:
+            return None
+        return state, page_buffer, frame
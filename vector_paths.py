@@ -0,0 +1,436 @@
+#########################################################################
+#     PatternPDFProjector - PDF Viewer for sewing pattern projection
+#     Copyright (C) 2024 Pere Rafols Soler
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+# Extraction of the PDF line art of a page as flattened polylines, used to draw the pattern
+# directly at projector resolution. Line widths and dash patterns are kept, line caps and joins are not.
+# Text, images and clipping paths are not extracted.
+
+import math
+
+from PyQt5.QtGui import QPolygonF, QPainterPath, QPen, QColor
+from PyQt5.QtCore import Qt, QPointF
+import numpy as np
+import cv2 as cv
+import pikepdf
+
+import frame_composer as frameComposer
+
+GRID_CELL_SIZE = 128 # Spatial index cell size in rendered page pixels
+MAX_CHUNK_POINTS = 64 # Stroked polylines are split in chunks to keep their bounding boxes tight
+MAX_FORM_DEPTH = 16
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+# PDF matrices are (a, b, c, d, e, f) using row vectors: [x y 1] x M
+def matMultiply(m1, m2):
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+def matTransform(m, x, y):
+    a, b, c, d, e, f = m
+    return a * x + c * y + e, b * x + d * y + f
+
+def flattenBezier(p0, p1, p2, p3):
+    # Flattens a cubic bezier (already in rendered page pixels) to about one segment every two pixels
+    ctrlLength = math.dist(p0, p1) + math.dist(p1, p2) + math.dist(p2, p3)
+    steps = max(2, min(64, int(ctrlLength / 2)))
+    t = np.linspace(0.0, 1.0, steps + 1)[1:, np.newaxis]
+    pts = (((1 - t) ** 3) * p0 + 3 * ((1 - t) ** 2) * t * p1 +
+           3 * (1 - t) * (t ** 2) * p2 + (t ** 3) * p3)
+    return [tuple(p) for p in pts]
+
+def matScale(m):
+    # Mean scale factor of a matrix, used for line widths and dash lengths
+    a, b, c, d, e, f = m
+    return math.sqrt(math.fabs(a * d - b * c))
+
+def dashFromOperands(array, phase):
+    # PDF dash array and phase to a (lengths, phase) tuple, None for solid lines
+    try:
+        lengths = tuple(float(v) for v in array)
+        phase = float(phase)
+    except (TypeError, ValueError):
+        return None
+    if not lengths or sum(lengths) <= 0 or min(lengths) < 0:
+        return None
+    return lengths, phase
+
+DEVICE_SPACES = {'/DeviceGray': 1, '/DeviceRGB': 3, '/DeviceCMYK': 4, '/CalGray': 1, '/CalRGB': 3,
+                 '/G': 1, '/RGB': 3, '/CMYK': 4}
+
+def colorSpaceComponents(space, resources):
+    # Number of components of a gray, RGB or CMYK like color space, None for the rest (spot colors, patterns...)
+    if isinstance(space, pikepdf.Name) and str(space) not in DEVICE_SPACES:
+        space = resources.get('/ColorSpace', pikepdf.Dictionary()).get(space)
+    if isinstance(space, pikepdf.Name):
+        return DEVICE_SPACES.get(str(space))
+    if isinstance(space, pikepdf.Array) and len(space) > 0:
+        family = str(space[0])
+        if family in ('/CalGray', '/CalRGB'):
+            return DEVICE_SPACES[family]
+        if family == '/ICCBased' and len(space) > 1:
+            components = int(space[1].get('/N', 0))
+            return components if components in (1, 3, 4) else None
+    return None
+
+def colorFromOperands(operands, components=None):
+    # Gray, RGB and CMYK color operands to an RGB tuple in 0..1, anything else (patterns, spot colors) is black.
+    # components is the size of the current color space, None if it is not a gray, RGB or CMYK one.
+    try:
+        values = [float(v) for v in operands]
+    except (TypeError, ValueError):
+        return (0.0, 0.0, 0.0)
+    if components is None or len(values) != components:
+        return (0.0, 0.0, 0.0)
+    if len(values) == 1:
+        return (values[0], values[0], values[0])
+    if len(values) == 3:
+        return tuple(values)
+    if len(values) == 4:
+        c, m, y, k = values
+        return ((1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k))
+    return (0.0, 0.0, 0.0)
+
+def hsvColorEffect(rgb, hue_offset, sat_multiplier, val_multiplier, bInvert):
+    # Applies the same color effects as the raster pipeline to a single color
+    bgr = np.array([[[round(rgb[2] * 255), round(rgb[1] * 255), round(rgb[0] * 255)]]], dtype=np.uint8)
+    hsv = frameComposer.applyColorEffects(frameComposer.bgr2hsv(bgr), hue_offset, sat_multiplier, val_multiplier)
+    b, g, r = cv.cvtColor(hsv, cv.COLOR_HSV2BGR)[0, 0]
+    color = QColor(int(r), int(g), int(b))
+    if bInvert:
+        color = QColor(255 - int(r), 255 - int(g), 255 - int(b))
+    return color
+
+class VectorItem:
+    def __init__(self, shape, bbox, strokeColor, fillColor, ocGroups, lineWidth=0.0, dash=None, dashOffset=0.0):
+        self.shape = shape # QPolygonF for strokes, QPainterPath for fills
+        self.bbox = bbox # (x0, y0, x1, y1) in rendered page pixels
+        self.strokeColor = strokeColor
+        self.fillColor = fillColor
+        self.ocGroups = ocGroups # Tuple of optional content name sets, the item is hidden if any set is fully hidden
+        self.lineWidth = lineWidth # Rendered page pixels
+        self.dash = dash # Dash lengths in rendered page pixels, None for solid lines
+        self.dashOffset = dashOffset # Dash position at the first point, chunks continue the pattern of the stroke
+
+class VectorPage:
+    def __init__(self):
+        self.items = []
+        self.grid = {}
+
+    def addStroke(self, points, color, ocGroups, lineWidth=0.0, dash=None):
+        # dash is a (lengths, phase) tuple in rendered page pixels or None
+        dashLengths, dashPhase = dash if dash is not None else (None, 0.0)
+        distances = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(np.array(points), axis=0), axis=1))))
+        start = 0
+        while start < len(points) - 1:
+            chunk = np.array(points[start:start + MAX_CHUNK_POINTS])
+            polygon = QPolygonF([QPointF(x, y) for x, y in chunk])
+            self.addItem(VectorItem(polygon, self.boundingBox(chunk), color, None, ocGroups,
+                                    lineWidth, dashLengths, dashPhase + float(distances[start])))
+            start += MAX_CHUNK_POINTS - 1 # Chunks share their end point
+
+    def addFill(self, subpaths, color, bEvenOdd, ocGroups):
+        path = QPainterPath()
+        path.setFillRule(Qt.OddEvenFill if bEvenOdd else Qt.WindingFill)
+        for points in subpaths:
+            path.moveTo(*points[0])
+            for x, y in points[1:]:
+                path.lineTo(x, y)
+            path.closeSubpath()
+        allPoints = np.array([p for points in subpaths for p in points])
+        self.addItem(VectorItem(path, self.boundingBox(allPoints), None, color, ocGroups))
+
+    def boundingBox(self, points):
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        return float(x0), float(y0), float(x1), float(y1)
+
+    def addItem(self, item):
+        itemId = len(self.items)
+        self.items.append(item)
+        x0, y0, x1, y1 = item.bbox
+        for cx in range(int(x0 // GRID_CELL_SIZE), int(x1 // GRID_CELL_SIZE) + 1):
+            for cy in range(int(y0 // GRID_CELL_SIZE), int(y1 // GRID_CELL_SIZE) + 1):
+                self.grid.setdefault((cx, cy), []).append(itemId)
+
+    def query(self, x0, y0, x1, y1):
+        # Ids of the items intersecting the rectangle, in painting order
+        ids = set()
+        for cx in range(int(x0 // GRID_CELL_SIZE), int(x1 // GRID_CELL_SIZE) + 1):
+            for cy in range(int(y0 // GRID_CELL_SIZE), int(y1 // GRID_CELL_SIZE) + 1):
+                ids.update(self.grid.get((cx, cy), ()))
+        result = []
+        for itemId in ids:
+            bx0, by0, bx1, by1 = self.items[itemId].bbox
+            if bx1 >= x0 and bx0 <= x1 and by1 >= y0 and by0 <= y1:
+                result.append(itemId)
+        result.sort()
+        return result
+
+    def draw(self, qp, visibleRect, hiddenLayers, mapColor, penWidth, growWidth=0.0):
+        # Draws the items inside visibleRect (QRectF in rendered page pixels) with the current painter transform.
+        # Strokes are at least penWidth projector pixels wide, growWidth is added to their PDF line width.
+        scale = math.sqrt(math.fabs(qp.transform().determinant())) # Rendered page pixels to projector pixels
+        pens = {}
+        for itemId in self.query(visibleRect.left(), visibleRect.top(), visibleRect.right(), visibleRect.bottom()):
+            item = self.items[itemId]
+            if any(names <= hiddenLayers for names in item.ocGroups):
+                continue
+            if item.fillColor is not None:
+                qp.setPen(Qt.NoPen)
+                qp.setBrush(mapColor(item.fillColor))
+                qp.drawPath(item.shape)
+            if item.strokeColor is not None:
+                style = (item.strokeColor, item.lineWidth, item.dash)
+                if style not in pens:
+                    pen = QPen(mapColor(item.strokeColor))
+                    pen.setCosmetic(True) # Width in projector pixels, independent of the transform
+                    pen.setWidthF(max(penWidth, item.lineWidth * scale + growWidth))
+                    if item.dash is not None:
+                        # Qt dash lengths are in pen widths and need an even count, PDF repeats odd arrays
+                        lengths = item.dash if len(item.dash) % 2 == 0 else item.dash * 2
+                        pen.setDashPattern([max(0.01, length * scale / pen.widthF()) for length in lengths])
+                    pens[style] = pen
+                pen = pens[style]
+                if item.dash is not None:
+                    pen.setDashOffset(item.dashOffset * scale / pen.widthF())
+                qp.setPen(pen)
+                qp.setBrush(Qt.NoBrush)
+                qp.drawPolyline(item.shape)
+
+class ContentParser:
+    def __init__(self, vectorPage, pageMatrix):
+        self.page = vectorPage
+        self.ctm = pageMatrix
+        self.strokeColor = (0.0, 0.0, 0.0)
+        self.fillColor = (0.0, 0.0, 0.0)
+        self.strokeSpace = 1 # Components of the current color spaces, None for spot colors and patterns
+        self.fillSpace = 1
+        self.lineWidth = 1.0 # User space units
+        self.dash = None # (lengths, phase) in user space units
+        self.stateStack = []
+        self.ocStack = []
+        self.subpaths = []
+        self.current = None
+        self.startPoint = None
+
+    def point(self, x, y):
+        return matTransform(self.ctm, float(x), float(y))
+
+    def saveState(self):
+        self.stateStack.append((self.ctm, self.strokeColor, self.fillColor, self.strokeSpace, self.fillSpace,
+                                self.lineWidth, self.dash))
+
+    def restoreState(self):
+        if self.stateStack:
+            (self.ctm, self.strokeColor, self.fillColor, self.strokeSpace, self.fillSpace,
+             self.lineWidth, self.dash) = self.stateStack.pop()
+
+    def setExtGState(self, name, resources):
+        gstate = resources.get('/ExtGState', pikepdf.Dictionary()).get(name)
+        if not isinstance(gstate, pikepdf.Dictionary):
+            return
+        if '/LW' in gstate:
+            self.lineWidth = float(gstate['/LW'])
+        if '/D' in gstate and len(gstate['/D']) == 2:
+            self.dash = dashFromOperands(gstate['/D'][0], gstate['/D'][1])
+
+    def ocGroups(self):
+        return tuple(names for names in self.ocStack if names is not None)
+
+    def ocNames(self, props, resources):
+        if isinstance(props, pikepdf.Name):
+            props = resources.get('/Properties', pikepdf.Dictionary()).get(props)
+        if not isinstance(props, pikepdf.Dictionary):
+            return None
+        if props.get('/Type') == '/OCMD':
+            ocgs = props.get('/OCGs', pikepdf.Array())
+            if isinstance(ocgs, pikepdf.Dictionary):
+                ocgs = [ocgs]
+            return frozenset(str(ocg.get('/Name', '')) for ocg in ocgs)
+        return frozenset([str(props.get('/Name', ''))])
+
+    def lineTo(self, p):
+        if self.current is None:
+            self.moveTo(p)
+            return
+        self.subpaths[-1].append(p)
+        self.current = p
+
+    def moveTo(self, p):
+        self.subpaths.append([p])
+        self.current = p
+        self.startPoint = p
+
+    def closePath(self):
+        if self.subpaths and self.startPoint is not None and len(self.subpaths[-1]) > 1:
+            self.subpaths[-1].append(self.startPoint)
+            self.subpaths.append([self.startPoint]) # Drawing continues from the start point in a new subpath
+            self.current = self.startPoint
+
+    def paint(self, bStroke, bFill, bEvenOdd):
+        subpaths = [s for s in self.subpaths if len(s) > 1]
+        if bFill and subpaths:
+            self.page.addFill(subpaths, self.fillColor, bEvenOdd, self.ocGroups())
+        if bStroke:
+            # Widths and dashes are mapped with the current matrix, as PDF does when stroking
+            scale = matScale(self.ctm)
+            dash = None
+            if self.dash is not None:
+                dash = (tuple(length * scale for length in self.dash[0]), self.dash[1] * scale)
+            for s in subpaths:
+                self.page.addStroke(s, self.strokeColor, self.ocGroups(), self.lineWidth * scale, dash)
+        self.subpaths = []
+        self.current = None
+        self.startPoint = None
+
+    def parse(self, contents, resources, depth=0):
+        for instruction in pikepdf.parse_content_stream(contents):
+            op = str(instruction.operator)
+            args = instruction.operands
+            if op == 'q':
+                self.saveState()
+            elif op == 'Q':
+                self.restoreState()
+            elif op == 'w':
+                self.lineWidth = float(args[0])
+            elif op == 'd':
+                self.dash = dashFromOperands(args[0], args[1])
+            elif op == 'gs':
+                self.setExtGState(args[0], resources)
+            elif op == 'cm':
+                self.ctm = matMultiply(tuple(float(v) for v in args), self.ctm)
+            elif op == 'm':
+                self.moveTo(self.point(*args))
+            elif op == 'l':
+                self.lineTo(self.point(*args))
+            elif op in ('c', 'v', 'y'):
+                if self.current is None:
+                    continue
+                p0 = np.array(self.current)
+                if op == 'c':
+                    p1, p2, p3 = self.point(*args[0:2]), self.point(*args[2:4]), self.point(*args[4:6])
+                elif op == 'v':
+                    p1, p2, p3 = self.current, self.point(*args[0:2]), self.point(*args[2:4])
+                else:
+                    p1, p2, p3 = self.point(*args[0:2]), self.point(*args[2:4]), self.point(*args[2:4])
+                for p in flattenBezier(p0, np.array(p1), np.array(p2), np.array(p3)):
+                    self.lineTo(p)
+            elif op == 'h':
+                self.closePath()
+            elif op == 're':
+                x, y, w, h = (float(v) for v in args)
+                self.moveTo(self.point(x, y))
+                self.lineTo(self.point(x + w, y))
+                self.lineTo(self.point(x + w, y + h))
+                self.lineTo(self.point(x, y + h))
+                self.closePath()
+            elif op == 'S':
+                self.paint(True, False, False)
+            elif op == 's':
+                self.closePath()
+                self.paint(True, False, False)
+            elif op in ('f', 'F', 'f*'):
+                self.paint(False, True, op == 'f*')
+            elif op in ('B', 'B*'):
+                self.paint(True, True, op == 'B*')
+            elif op in ('b', 'b*'):
+                self.closePath()
+                self.paint(True, True, op == 'b*')
+            elif op == 'n':
+                self.paint(False, False, False)
+            elif op in ('G', 'RG', 'K'):
+                self.strokeSpace = {'G': 1, 'RG': 3, 'K': 4}[op]
+                self.strokeColor = colorFromOperands(args, self.strokeSpace)
+            elif op in ('g', 'rg', 'k'):
+                self.fillSpace = {'g': 1, 'rg': 3, 'k': 4}[op]
+                self.fillColor = colorFromOperands(args, self.fillSpace)
+            elif op in ('SC', 'SCN'):
+                self.strokeColor = colorFromOperands(args, self.strokeSpace)
+            elif op in ('sc', 'scn'):
+                self.fillColor = colorFromOperands(args, self.fillSpace)
+            elif op == 'CS':
+                self.strokeSpace = colorSpaceComponents(args[0], resources)
+                self.strokeColor = (0.0, 0.0, 0.0)
+            elif op == 'cs':
+                self.fillSpace = colorSpaceComponents(args[0], resources)
+                self.fillColor = (0.0, 0.0, 0.0)
+            elif op == 'BMC':
+                self.ocStack.append(None)
+            elif op == 'BDC':
+                names = None
+                if len(args) == 2 and args[0] == '/OC':
+                    names = self.ocNames(args[1], resources)
+                self.ocStack.append(names)
+            elif op == 'EMC':
+                if self.ocStack:
+                    self.ocStack.pop()
+            elif op == 'Do' and depth < MAX_FORM_DEPTH:
+                xobj = resources.get('/XObject', pikepdf.Dictionary()).get(args[0])
+                if xobj is None or xobj.get('/Subtype') != '/Form':
+                    continue
+                self.saveState()
+                formMatrix = tuple(float(v) for v in xobj.get('/Matrix', IDENTITY))
+                self.ctm = matMultiply(formMatrix, self.ctm)
+                ocNames = self.ocNames(xobj['/OC'], resources) if '/OC' in xobj else None
+                self.ocStack.append(ocNames)
+                self.parse(xobj, xobj.get('/Resources', resources), depth + 1)
+                self.ocStack.pop()
+                self.restoreState()
+
+def inheritedAttribute(pageObj, key):
+    # Page attributes like /Rotate and the boxes can be set on an ancestor in the page tree
+    node = pageObj
+    for _ in range(MAX_FORM_DEPTH):
+        if node is None:
+            break
+        if key in node:
+            return node[key]
+        node = node.get('/Parent')
+    return None
+
+def extractPagePaths(pdf_filename, page_index, renderDPI):
+    # Returns a VectorPage with the line art of the page in the pixel coordinates of a poppler render at renderDPI
+    with pikepdf.Pdf.open(pdf_filename) as pdf:
+        page = pdf.pages[page_index]
+        userunit = float(page.UserUnit) if '/UserUnit' in page else 1.0
+        box = inheritedAttribute(page.obj, '/CropBox')
+        if box is None:
+            box = inheritedAttribute(page.obj, '/MediaBox')
+        x0 = min(float(box[0]), float(box[2]))
+        y1 = max(float(box[1]), float(box[3]))
+        s = renderDPI * userunit / 72.0
+        width = math.fabs(float(box[2]) - float(box[0])) * s
+        height = math.fabs(float(box[3]) - float(box[1])) * s
+        pageMatrix = (s, 0.0, 0.0, -s, -x0 * s, y1 * s) # PDF user space to top-down rendered pixels
+        # Poppler renders the page turned clockwise by /Rotate
+        rotate = int(inheritedAttribute(page.obj, '/Rotate') or 0) % 360
+        if rotate == 90:
+            pageMatrix = matMultiply(pageMatrix, (0.0, 1.0, -1.0, 0.0, height, 0.0))
+        elif rotate == 180:
+            pageMatrix = matMultiply(pageMatrix, (-1.0, 0.0, 0.0, -1.0, width, height))
+        elif rotate == 270:
+            pageMatrix = matMultiply(pageMatrix, (0.0, -1.0, 1.0, 0.0, 0.0, width))
+
+        vectorPage = VectorPage()
+        parser = ContentParser(vectorPage, pageMatrix)
+        parser.parse(page.obj, page.obj.get('/Resources', pikepdf.Dictionary()))
+    return vectorPage